@@ -1,15 +1,26 @@
 import streamlit as st
+from streamlit.runtime import Runtime
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 from random import choice as randomize
 import ollama_tools
+import ollama_server
+import model_residency
+import telemetry
+import model_catalog
+import transcript_store
+import scheduler
 import time
 import embedded_styles
-import pprint
 import os
-from datetime import datetime
 import uuid
+from conversation_engine import ConversationEngine
+from fan_out import FanOut, MAX_MODELS as MAX_FAN_OUT_MODELS
+from turn_log import TurnLog
 
 TITLE = "Welcome to Talking Heads AI"
 CHAT_SPACE_HEIGHT = 510
+TRANSCRIPT_HEIGHT = CHAT_SPACE_HEIGHT - 60 # leaves room for the clear button
+FAN_OUT_SYSTEM_PROMPT = "You are a helpful assistant."
 
 def load_css(filename):
     # getting an absolute path to css
@@ -41,6 +52,10 @@ def begin_conversation():
         st.session_state.model_asked = ""
         st.session_state.talk_started = False
 
+    # a new conversation gets a new engine
+    if st.session_state.talk_started:
+        stop_conversation("replaced")
+
     # clear inputs
     st.session_state.input_a = ""
     st.session_state.input_b = ""
@@ -56,28 +71,170 @@ def get_model_name_by_alias(alias: str) -> str:
     except Exception as e:
         raise ValueError(e)
 
+def get_session_id() -> str:
+    if "session_id" not in st.session_state:
+        st.session_state["session_id"] = str(uuid.uuid4())[:8]
+    return st.session_state.session_id
+
+def warm_selected_models() -> None:
+    """Start loading the picked models so the first turn doesn't pay for a cold start."""
+    for alias in (st.session_state.left_model_alias, st.session_state.right_model_alias):
+        if alias:
+            model_residency.warm(get_model_name_by_alias(alias), get_session_id())
+
+def on_model_change() -> None:
+    clear_conversation_log()
+    warm_selected_models()
+
+def describe_models(group: str) -> str:
+    """Size and quantization of the models in a group, shown next to the model picker."""
+    catalog = model_catalog.get_catalog().get()
+    return "  \n".join(catalog[alias].describe() for alias in st.session_state.model_data[group] if alias in catalog)
+
+def warn_if_pair_too_large() -> None:
+    left_alias, right_alias = st.session_state.left_model_alias, st.session_state.right_model_alias
+    if not left_alias or not right_alias:
+        return
+    if not model_catalog.get_catalog().pair_fits(get_model_name_by_alias(left_alias), get_model_name_by_alias(right_alias)):
+        st.caption(f"⚠️ {left_alias} and {right_alias} don't fit in memory together, replies will be slower. Try a smaller pair.")
+
+def stop_conversation(reason: str) -> None:
+    """Cancel the running conversation, if any, so the server doesn't keep generating replies nobody will see."""
+    engine = st.session_state.get("engine")
+    if engine is not None:
+        engine.cancel(reason)
+    st.session_state.engine = None
+
 def clear_conversation_log() -> None:
     """Clear conversation history in case something gets reset. Used to reset the conversation."""
-    st.session_state.conversation_log["left_model_log"].clear()
-    st.session_state.conversation_log["right_model_log"].clear()
+    stop_conversation("cleared")
+    st.session_state.conversation_log.clear()
     st.session_state.show_clear_button = False
 
+def page_liveness_check():
+    """Callback telling a background engine whether this browser tab is still connected."""
+    ctx = get_script_run_ctx()
+    if ctx is None or not Runtime.exists():
+        return None # bare script runs and tests have no browser to lose
+    runtime, page_session_id = Runtime.instance(), ctx.session_id
+    return lambda: runtime.is_active_session(page_session_id)
+
 def update_system_prompts(new_prompt: str, side: str) -> None:
     """Update system prompts in session state to preserve them across different models."""
     st.session_state[f"{side}_system_prompt"] = new_prompt
 
-def wait_for_ollama(timeout=30):
-    """Keep sending requests to ollama every second until it responds"""
-    import requests
-    for _ in range(timeout):
-        try:
-            res = requests.get("http://localhost:11434/api/tags")
-            if res.status_code == 200:
-                return True
-        except requests.exceptions.ConnectionError:
-            pass
-        time.sleep(1)
-    raise RuntimeError(f"Ollama server did not become ready in {timeout} seconds.")
+def start_conversation_engine() -> ConversationEngine:
+    """Hand the conversation over to a background engine. The script run only renders its events."""
+    asked_side = "left" if st.session_state.model_asked == st.session_state.left_model_alias else "right"
+    aliases = { "left": st.session_state.left_model_alias, "right": st.session_state.right_model_alias }
+    engine = ConversationEngine(
+        models={ side: get_model_name_by_alias(alias) for side, alias in aliases.items() },
+        aliases=aliases,
+        system_prompts={ "left": st.session_state.left_system_prompt, "right": st.session_state.right_system_prompt },
+        first_side=asked_side,
+        initial_prompt=st.session_state.initial_prompt,
+        max_turns=st.session_state.max_turns,
+        use_context=st.session_state.use_context,
+        history=st.session_state.conversation_log,
+        session_id=get_session_id(),
+        on_finish=transcript_saver(),
+        is_alive=page_liveness_check(),
+    )
+    return engine.start()
+
+def chat_transcript() -> None:
+    """Fragment that pushes new conversation events to the transcript component. While a conversation is running
+    it reruns on its own once per frame, without rerunning the rest of the page."""
+    engine = st.session_state.engine
+    render_started = time.perf_counter()
+    sent = embedded_styles.render_transcript(engine, st.session_state.transcript_state, TRANSCRIPT_HEIGHT)
+    if sent:
+        telemetry.record_render(get_session_id(), time.perf_counter() - render_started)
+    if engine is not None and engine.finished and st.session_state.transcript_state["sent"] == engine.event_count:
+        # the browser has every token, the session only needs to keep one event per turn; the next run sends the
+        # compacted transcript once, under its new id
+        engine.compact_events()
+    if st.session_state.talk_started and engine.finished and not sent:
+        # everything has reached the browser, rerun the page to bring back the controls
+        st.rerun()
+
+def show_performance_stats() -> None:
+    model_stats = telemetry.session_model_summaries(get_session_id())
+    if not model_stats:
+        return
+    with st.expander("Performance", expanded=False):
+        rows = []
+        for model, stats in model_stats.items():
+            rows.append({
+                "model": model,
+                "turns": stats["turns"],
+                "tokens/s": stats["tokens_per_second"],
+                "TTFT (s)": stats["avg_ttft"],
+                "prompt eval share": stats["prompt_eval_share"],
+                "reasoning tokens dropped": stats["reasoning_tokens"],
+            })
+        st.dataframe(rows, hide_index=True)
+        render_time = telemetry.session_summary(get_session_id()).get("avg_render_time")
+        if render_time is not None:
+            st.caption(f"Average render time per update: {render_time * 1000:.1f} ms")
+
+def begin_fan_out() -> None:
+    """Input callback of fan-out mode: send the prompt to every picked model at once."""
+    prompt = st.session_state.fan_out_input.strip()
+    st.session_state.fan_out_input = ""
+    if not prompt or not st.session_state.fan_out_aliases:
+        return
+    stop_fan_out()
+    models = { alias: get_model_name_by_alias(alias) for alias in st.session_state.fan_out_aliases }
+    st.session_state.fan_out = FanOut(models, st.session_state.fan_out_system_prompt, prompt, get_session_id(),
+                                       is_alive=page_liveness_check()).start()
+
+def stop_fan_out() -> None:
+    fan_out = st.session_state.get("fan_out")
+    if fan_out is not None:
+        fan_out.cancel()
+    st.session_state.fan_out = None
+
+def fan_out_columns() -> None:
+    """Fragment with one column per model. While replies stream in it reruns on its own once per frame."""
+    fan_out = st.session_state.fan_out
+    if fan_out is None:
+        return
+    st.caption("“ *" + fan_out.prompt + "* ”")
+    for column, reply in zip(st.columns(len(fan_out.replies), border=True), fan_out.replies):
+        with column:
+            st.markdown(f"**{reply.alias}**")
+            if reply.status == "queued":
+                st.caption(f"waiting for the server (position {reply.position} in line)" if reply.position else "thinking...")
+            elif reply.status == "error":
+                st.error(reply.error)
+            st.markdown(reply.text)
+            if reply.metrics is not None:
+                tokens_per_second = reply.tokens_per_second()
+                speed = f" · {tokens_per_second:.1f} tokens/s" if tokens_per_second else ""
+                waited = f" · waited {reply.queue_wait:.1f}s for the server" if reply.queue_wait >= 0.1 else ""
+                st.caption(f"TTFT {reply.metrics.ttft:.2f}s{speed} · {reply.metrics.duration:.1f}s total{waited}")
+    if fan_out.finished:
+        st.caption(f"All replies in {fan_out.wall_time:.1f}s")
+        if st.session_state.fan_out_live:
+            # stop refreshing
+            st.rerun()
+
+def show_fan_out() -> None:
+    st.subheader("Fan-out: one prompt, many models")
+    settings, prompt_box = st.columns([1, 2])
+    with settings:
+        st.multiselect("Models:", st.session_state.model_data["all_models"].keys(), key="fan_out_aliases",
+                       max_selections=MAX_FAN_OUT_MODELS, help=describe_models("all_models"))
+        parallel = scheduler.get_scheduler().max_concurrency
+        if len(st.session_state.fan_out_aliases) > parallel:
+            st.caption(f"The server generates {parallel} {'reply' if parallel == 1 else 'replies'} at a time, the other models wait their turn.")
+        st.text_area("System prompt:", key="fan_out_system_prompt", height=100)
+    with prompt_box:
+        st.text_input("Ask all of them:", placeholder="Hit ENTER when done", key="fan_out_input", on_change=begin_fan_out)
+    fan_out = st.session_state.fan_out
+    st.session_state.fan_out_live = fan_out is not None and not fan_out.finished
+    st.fragment(fan_out_columns, run_every=embedded_styles.FRAME_BUDGET if st.session_state.fan_out_live else None)()
 
 def get_country_code():
     lang = st.context.headers.get("Accept-Language", "")
@@ -85,14 +242,11 @@ def get_country_code():
         return lang.split(",")[0].split("-")[1].upper()
     return "UNK"
 
-def get_log_file_path():
-    if "log_file_path" not in st.session_state:
-        country = get_country_code()
-        session_id = str(uuid.uuid4())[:8]
-        filename = f"logs/debug_{country}_{session_id}.log"
-        full_path = os.path.join(os.path.dirname(__file__), filename)
-        st.session_state["log_file_path"] = full_path
-    return st.session_state.log_file_path
+def transcript_saver():
+    """Callback that hands a finished conversation to the transcript store, which writes it in the background.
+    Request details are captured now, the callback runs on the engine's loop where there is no script context."""
+    details = { "country": get_country_code(), "headers": dict(st.context.headers) }
+    return lambda engine: transcript_store.get_store().save(dict(engine.to_record(), **details))
 
 def main():
     st.set_page_config(layout="wide", initial_sidebar_state="collapsed")
@@ -100,19 +254,19 @@ def main():
 
     st.title(TITLE)
 
-    # start ollama
-    ollama_tools.start_ollama()
-    with st.spinner("Waiting for Ollama to wake up... 🦙🦙🦙"):
-        try:
-            wait_for_ollama()
-        except RuntimeError:
-            st.warning("The LLM server failed to start on time. Try again.")
-            st.stop()
+    # start ollama, or attach to a running server. Once it's up this is a cached check.
+    server = ollama_server.get_server()
+    if not server.ready:
+        with st.spinner("Waiting for Ollama to wake up... 🦙🦙🦙"):
+            try:
+                server.ensure_started()
+            except RuntimeError as e:
+                st.warning(f"The LLM server failed to start: {e} Try again.")
+                st.stop()
 
     # Initialize params in session state
     if "model_data" not in st.session_state:
-        model_names = ollama_tools.get_models()
-        model_data = ollama_tools.assign_model_aliases(model_names) # { "alias": "model_name" }
+        model_data = model_catalog.get_catalog().aliases() # { "alias": "model_name" }, shared by all sessions
         left_group, right_group = ollama_tools.split_models_into_groups(model_data) # { "alias": "model_name" }
         st.session_state["model_data"] = {}
         st.session_state["model_data"]["all_models"] = model_data
@@ -132,6 +286,7 @@ def main():
         st.session_state["left_model_alias"] = randomize(list(st.session_state["model_data"]["left_group"].keys()))
     if "right_model_alias" not in st.session_state:
         st.session_state["right_model_alias"] = randomize(list(st.session_state["model_data"]["right_group"].keys()))
+        warm_selected_models()
     if "left_system_prompt" not in st.session_state:
         st.session_state["left_system_prompt"] = ollama_tools.DEFAULT_SYSTEM_PROMPT_LEFT
     if "right_system_prompt" not in st.session_state:
@@ -141,9 +296,30 @@ def main():
     if "use_context" not in st.session_state:
         st.session_state["use_context"] = True
     if "conversation_log" not in st.session_state:
-        st.session_state["conversation_log"] = { "left_model_log": [], "right_model_log": [] }
+        st.session_state["conversation_log"] = TurnLog() # both models' histories are views of it
     if "show_clear_button" not in st.session_state:
         st.session_state["show_clear_button"] = False
+    if "engine" not in st.session_state:
+        st.session_state["engine"] = None
+    if "transcript_state" not in st.session_state:
+        st.session_state["transcript_state"] = {}
+    if "fan_out_mode" not in st.session_state:
+        st.session_state["fan_out_mode"] = False
+    if "fan_out" not in st.session_state:
+        st.session_state["fan_out"] = None
+    if "fan_out_aliases" not in st.session_state:
+        st.session_state["fan_out_aliases"] = [alias for alias in (st.session_state.left_model_alias, st.session_state.right_model_alias) if alias]
+    if "fan_out_system_prompt" not in st.session_state:
+        st.session_state["fan_out_system_prompt"] = FAN_OUT_SYSTEM_PROMPT
+    if "fan_out_input" not in st.session_state:
+        st.session_state["fan_out_input"] = ""
+
+    if st.session_state.talk_started:
+        if st.session_state.engine is None:
+            st.session_state.engine = start_conversation_engine()
+        elif st.session_state.engine.finished:
+            st.session_state.talk_started = False
+            st.session_state.show_clear_button = True
 
     # Hide sidebar when conversation is ongoing
     if st.session_state.talk_started:
@@ -167,6 +343,10 @@ def main():
         st.slider("Messages to generate per conversation", min_value=2, max_value=50, step=1, key="max_turns")
         # Use context
         st.checkbox("Take context into account", key="use_context", help="If enabled, models will remember the context of the conversation.")
+        # Fan-out mode
+        st.toggle("Fan-out mode", key="fan_out_mode", on_change=stop_fan_out, help="Send one prompt to several models at once and compare their replies side by side.")
+        # Performance of this session's turns
+        show_performance_stats()
         # New conversation button
         if st.button("Restart"):
             st.session_state.talk_started = False
@@ -177,6 +357,7 @@ def main():
             st.session_state.left_system_prompt = ollama_tools.DEFAULT_SYSTEM_PROMPT_LEFT
             st.session_state.right_system_prompt = ollama_tools.DEFAULT_SYSTEM_PROMPT_RIGHT
             clear_conversation_log()
+            warm_selected_models()
             st.rerun()
 
     # Header (3 tiles)
@@ -209,13 +390,14 @@ def main():
         else:
             st.write(f"To start a conversation, ask or say something to one of the models: {st.session_state.left_model_alias} or {st.session_state.right_model_alias}.")
             st.caption("*[initial prompt goes here]*")
+            warn_if_pair_too_large()
         st.markdown("</div>", unsafe_allow_html=True)
 
     # Body (3 tiles)
     model_left, chat_area, model_right = st.columns([1, 2, 1], border=True)
     with model_left:
         st.markdown('<div class="model-left">', unsafe_allow_html=True)
-        st.pills("Pick a model:", st.session_state.model_data["left_group"].keys(), selection_mode="single", key="left_model_alias", on_change=clear_conversation_log)
+        st.pills("Pick a model:", st.session_state.model_data["left_group"].keys(), selection_mode="single", key="left_model_alias", on_change=on_model_change, help=describe_models("left_group"))
         left_sys_prompt = st.text_area("System prompt:", value=st.session_state.left_system_prompt, placeholder=f"Give a role to {st.session_state.left_model_alias}", height=300)
         update_system_prompts(left_sys_prompt, "left")
         if st.button("🗑", key="left_trash", help="clear system prompt"):
@@ -223,7 +405,7 @@ def main():
         st.markdown("</div>", unsafe_allow_html=True)
     with model_right:
         st.markdown('<div class="model-right">', unsafe_allow_html=True)
-        st.pills("Pick a model:", st.session_state.model_data["right_group"].keys(), selection_mode="single", key="right_model_alias", on_change=clear_conversation_log)
+        st.pills("Pick a model:", st.session_state.model_data["right_group"].keys(), selection_mode="single", key="right_model_alias", on_change=on_model_change, help=describe_models("right_group"))
         right_sys_prompt = st.text_area("System prompt:", value=st.session_state.right_system_prompt, placeholder=f"Give a role to {st.session_state.right_model_alias}", height=300)
         update_system_prompts(right_sys_prompt, "right")
         if st.button("🗑", key="right_trash", help="clear system prompt"):
@@ -232,53 +414,8 @@ def main():
     with chat_area:
         with st.container(height=CHAT_SPACE_HEIGHT, border=False):
         
-            if st.session_state.talk_started:
-                # initialize the conversation
-                current_model_alias = st.session_state.model_asked
-                current_prompt = st.session_state.initial_prompt
-                current_system_prompt = st.session_state.left_system_prompt if current_model_alias == st.session_state.left_model_alias else st.session_state.right_system_prompt
-
-                for turn in range(st.session_state.max_turns): 
-
-                    # get the response from the current model
-                    current_model_name = get_model_name_by_alias(current_model_alias)
-                    model_side = "left" if current_model_alias == st.session_state.left_model_alias else "right"
-                    model_reply_generator = ollama_tools.get_llm_response_streaming(current_model_name, current_system_prompt, chat_history=st.session_state.conversation_log.get(f"{model_side}_model_log"), prompt=current_prompt)
-
-                    # Display model response
-                    placeholder = st.empty()
-                    with st.spinner(f"{current_model_alias} is thinking..."):
-                        # spin until the first chunk arrives
-                        first_chunk = next(model_reply_generator)["message"]["content"]
-                    # render first chunk
-                    embedded_styles.render_model_response(first_chunk, placeholder, model_side)
-                    time.sleep(0.15)
-                    model_full_message = first_chunk
-                    # keep iterating over the rest of the message
-                    for chunk in model_reply_generator:
-                        model_full_message += chunk['message']['content']
-                        embedded_styles.render_model_response(model_full_message, placeholder, model_side)
-                        time.sleep(0.15)
-
-                    # update conversation log for the model we just ran inference on
-                    if st.session_state.use_context:
-                        #    1) set current_prompt as user's content
-                        mcp_prompt = {"role": "user", "content": current_prompt}
-                        st.session_state.conversation_log[f"{model_side}_model_log"].append(mcp_prompt)
-                        #    2) set model_full_message as assistant's content
-                        mcp_response = {"role": "assistant", "content": model_full_message}
-                        st.session_state.conversation_log[f"{model_side}_model_log"].append(mcp_response)
-
-                    # update the prompt for the next model
-                    current_prompt = model_full_message
-                    # update system prompt for next model
-                    current_system_prompt = st.session_state.right_system_prompt if current_model_alias == st.session_state.left_model_alias else st.session_state.left_system_prompt
-                    # update the model for the next turn
-                    current_model_alias = st.session_state.right_model_alias if current_model_alias == st.session_state.left_model_alias else st.session_state.left_model_alias
-
-
-                st.session_state.talk_started = False
-                st.session_state.show_clear_button = True
+            live = st.session_state.talk_started
+            st.fragment(chat_transcript, run_every=embedded_styles.FRAME_BUDGET if live else None)()
 
             # Clear Conversation button
             if st.session_state.show_clear_button:
@@ -288,15 +425,8 @@ def main():
                     clear_conversation_log()
                     st.rerun()
 
-    if st.session_state.show_clear_button:
-        # log only once after conversation is finished
-        log_path = get_log_file_path()
-        with open(log_path, 'a') as f:
-            f.write("\n" + "="*50 + "\n")
-            f.write(f"🕒 New session started: {datetime.now().isoformat()}\n")
-            f.write("="*50 + "\n")
-            pprint.pprint(dict(st.session_state.conversation_log), stream=f)
-            pprint.pprint(dict(st.context.headers), stream=f)
+    if st.session_state.fan_out_mode:
+        show_fan_out()
 
     # st.write(st.session_state)
 
@@ -0,0 +1,30 @@
+import asyncio
+import threading
+
+# One asyncio event loop per process, running on a daemon thread. Generation work is scheduled here
+# so that it never blocks a Streamlit script thread.
+_loop = None
+_loop_thread = None
+_loop_lock = threading.Lock()
+
+def get_loop() -> asyncio.AbstractEventLoop:
+    """Return the process-wide background event loop, starting it on first use."""
+    global _loop, _loop_thread
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            _loop_thread = threading.Thread(target=_loop.run_forever, name="talking-heads-loop", daemon=True)
+            _loop_thread.start()
+    return _loop
+
+def submit(coro):
+    """Schedule a coroutine on the background loop and return a concurrent.futures.Future for it."""
+    return asyncio.run_coroutine_threadsafe(coro, get_loop())
+
+def run(coro, timeout=None):
+    """Run a coroutine on the background loop and block the calling thread until it finishes."""
+    return submit(coro).result(timeout)
+
+def in_background_loop() -> bool:
+    """True if the caller is running on the background loop thread."""
+    return _loop_thread is not None and threading.current_thread() is _loop_thread
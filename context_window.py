@@ -0,0 +1,78 @@
+import os
+import asyncio
+from collections.abc import Sequence
+import ollama_tools
+import model_catalog
+
+# Token budget for everything sent to a model in one turn: system prompt, history and the new prompt.
+# Counts are estimated from characters, which is close enough for budgeting and costs nothing.
+CHARS_PER_TOKEN = 4
+MESSAGE_OVERHEAD = 4 # tokens of role/template markup per message
+DEFAULT_TOKEN_BUDGET = int(os.environ.get("TALKING_HEADS_TOKEN_BUDGET", 2048))
+TOKEN_BUDGETS = {} # { "model_name": budget }, overrides the default for specific models
+RECENT_MESSAGES = 6 # the latest messages are sent verbatim, down to the last pair when they alone exceed the budget
+PROMPT_RESERVE = 256 # tokens kept free for the next prompt when compacting ahead of time
+LOW_WATERMARK = 0.6 # compaction shrinks the history to this share of the budget, so it doesn't run every turn
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+def message_tokens(message: dict) -> int:
+    return estimate_tokens(message["content"]) + MESSAGE_OVERHEAD
+
+def token_budget(model: str) -> int:
+    budget = TOKEN_BUDGETS.get(model, DEFAULT_TOKEN_BUDGET)
+    info = model_catalog.get_catalog().info(model)
+    if info and info.context_length:
+        # never plan for more context than the model has
+        budget = min(budget, info.context_length)
+    return budget
+
+class ContextWindow:
+    """History window of one side of a conversation. The history itself stays complete; the window sends the
+    recent messages verbatim and replaces older ones with a rolling summary. The summary is extended with the
+    messages that fall out of the window, it is never rebuilt from the full history."""
+
+    def __init__(self, model: str, budget=None, session_id=ollama_tools.DEFAULT_SESSION):
+        self.model = model
+        self.session_id = session_id
+        self.budget = budget or token_budget(model)
+        self.summary = ""
+        self.summarized = 0 # number of history messages folded into the summary
+        self._lock = asyncio.Lock()
+
+    def view(self, history: Sequence[dict]) -> list[dict]:
+        """Messages to send in place of the full history."""
+        messages = []
+        if self.summary:
+            messages.append({"role": "system", "content": f"Summary of the earlier conversation: {self.summary}"})
+        messages.extend(history[self.summarized:])
+        return messages
+
+    def view_tokens(self, history: Sequence[dict]) -> int:
+        return sum(message_tokens(message) for message in self.view(history))
+
+    async def fit(self, history: Sequence[dict], reserved_tokens: int) -> None:
+        """Make sure the window plus `reserved_tokens` (system prompt, prompt) stays within the budget."""
+        async with self._lock:
+            if self.view_tokens(history) + reserved_tokens <= self.budget:
+                return
+            target = self.budget * LOW_WATERMARK - reserved_tokens
+            foldable = max(len(history) - RECENT_MESSAGES, self.summarized)
+            newest = max(len(history) - 2, self.summarized) # the latest pair is always sent verbatim
+            end = self.summarized
+            tokens = self.view_tokens(history)
+            # fold whole user/assistant pairs, oldest first; recent pairs only when they alone overflow the budget
+            while end + 2 <= newest and tokens > target:
+                if end + 2 > foldable and tokens + reserved_tokens <= self.budget:
+                    break
+                tokens -= message_tokens(history[end]) + message_tokens(history[end + 1])
+                end += 2
+            if end == self.summarized:
+                return
+            try:
+                self.summary = await ollama_tools.summarize_history_async(self.model, self.summary, history[self.summarized:end], self.session_id)
+            except Exception as e:
+                # losing the oldest messages is better than overflowing the model's context
+                print(f"Could not summarize history for {self.model}: {e}")
+            self.summarized = end
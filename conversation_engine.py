@@ -0,0 +1,338 @@
+import asyncio
+import contextlib
+import uuid
+import time
+from dataclasses import dataclass
+import background_loop
+import ollama_tools
+import model_residency
+import telemetry
+import context_window
+from context_window import ContextWindow
+from reasoning_filter import ReasoningFilter
+from turn_log import TurnLog, Turn, OPENER
+
+LIVENESS_INTERVAL = 5 # seconds between two checks that the page watching a conversation is still connected
+DISCONNECT_GRACE = 30 # seconds a page may be gone, e.g. while reconnecting, before its conversation is cancelled
+
+@dataclass(slots=True)
+class EngineEvent:
+    kind: str # "turn_start", "queued", "token", "turn_end", "error", "cancelled" or "done"
+    turn: int = -1
+    side: str = ""
+    alias: str = ""
+    content: str = ""
+
+class EventLog:
+    """Append-only list of events. Any number of subscribers can replay it from the start and follow new events,
+    either from a sync thread (the Streamlit script) or from async code. The log lives on the background loop."""
+
+    def __init__(self):
+        self.events = []
+        self.closed = False
+        self.revision = 0 # goes up when the events are renumbered by compaction
+        self._changed = None
+
+    def _condition(self) -> asyncio.Condition:
+        # created lazily so that it binds to the background loop
+        if self._changed is None:
+            self._changed = asyncio.Condition()
+        return self._changed
+
+    async def append(self, event, close=False) -> None:
+        changed = self._condition()
+        async with changed:
+            self.events.append(event)
+            self.closed = self.closed or close
+            changed.notify_all()
+
+    async def close(self) -> None:
+        changed = self._condition()
+        async with changed:
+            self.closed = True
+            changed.notify_all()
+
+    async def _wait_for_events(self, start: int, timeout=None) -> list | None:
+        """Wait until there are events after `start`, returns an empty list once the log is closed and drained
+        and None if nothing arrived within `timeout` seconds."""
+        changed = self._condition()
+        async with changed:
+            try:
+                await asyncio.wait_for(changed.wait_for(lambda: len(self.events) > start or self.closed), timeout)
+            except asyncio.TimeoutError:
+                return None
+            return self.events[start:]
+
+    async def follow(self, start=0):
+        index = start
+        while True:
+            if background_loop.in_background_loop():
+                batch = await self._wait_for_events(index)
+            else:
+                batch = await asyncio.wrap_future(background_loop.submit(self._wait_for_events(index)))
+            if not batch:
+                return
+            for event in batch:
+                yield event
+            index += len(batch)
+
+    def compacted(self) -> "EventLog":
+        """Closed copy of a closed log with the tokens of every turn merged into one event."""
+        compact = EventLog()
+        for event in self.events:
+            last = compact.events[-1] if compact.events else None
+            if event.kind == "token" and last is not None and last.kind == "token" and (last.turn, last.side) == (event.turn, event.side):
+                compact.events[-1] = EngineEvent("token", last.turn, last.side, last.alias, last.content + event.content)
+            else:
+                compact.events.append(event)
+        compact.closed = True
+        compact.revision = self.revision + 1
+        return compact
+
+    def iter(self, start=0, timeout=None):
+        """Blocking iterator over the log. With a timeout it yields None whenever no event arrived in time."""
+        index = start
+        while True:
+            batch = background_loop.run(self._wait_for_events(index, timeout))
+            if batch is None:
+                yield None
+                continue
+            if not batch:
+                return
+            yield from batch
+            index += len(batch)
+
+class ConversationEngine:
+    """Runs a conversation between two models on the background loop, independently of any Streamlit script run.
+    The engine owns the turn alternation, hands every reply to the other model as its prompt and keeps
+    the per-side history. Pages subscribe to its events with iter_events() or `async for`, and stop it with cancel()."""
+
+    def __init__(self, models: dict[str, str], aliases: dict[str, str], system_prompts: dict[str, str],
+                 first_side: str, initial_prompt: str, max_turns: int, use_context=True, history=None, session_id="", on_finish=None,
+                 is_alive=None):
+        self.models = models # { "left": "model_name", "right": "model_name" }
+        self.aliases = aliases
+        self.system_prompts = system_prompts
+        self.first_side = first_side
+        self.initial_prompt = initial_prompt
+        self.max_turns = max_turns
+        self.use_context = use_context
+        self.history = history if history is not None else TurnLog() # shared with later conversations of the session
+        self.id = uuid.uuid4().hex[:8]
+        self.session_id = session_id or self.id
+        self.windows = { side: ContextWindow(model, session_id=self.session_id) for side, model in models.items() }
+        self._compactions = {} # { side: task that shrinks that side's window before its next turn }
+        self._preload = None # task loading the next speaker's model
+        self._queue_reports = set() # "queued" events on their way into the log, referenced until they got there
+        self.metrics = [] # telemetry.TurnMetrics of every finished turn
+        self.turns = [] # Turn of every finished turn, the same objects as in the history
+        self.started = None
+        self.finished_at = None
+        self.error = ""
+        self.on_finish = on_finish # called with the engine once the conversation is over, on the background loop
+        self.is_alive = is_alive # returns False once nobody is watching, checked from the background loop
+        self.cancel_reason = ""
+        self.log = EventLog()
+        self._compacted = False
+        self._future = None
+        self._task = None
+        self._turn_started = None # monotonic start of the turn being generated
+
+    @property
+    def finished(self) -> bool:
+        return self.log.closed
+
+    def start(self) -> "ConversationEngine":
+        if self._future is None:
+            self.started = time.time()
+            self._future = background_loop.submit(self._run())
+        return self
+
+    def cancel(self, reason="cancelled", timeout=5) -> None:
+        """Stop the conversation from a script thread: the reply being generated is cut off, which closes its
+        HTTP stream so the server stops generating, and the remaining turns are skipped. Returns once it stopped."""
+        if self._future is None or self._future.done():
+            return
+        try:
+            background_loop.run(self._cancel(reason), timeout)
+        except TimeoutError:
+            print(f"Conversation {self.id} did not stop within {timeout} seconds")
+
+    async def _cancel(self, reason: str) -> None:
+        self.cancel_reason = self.cancel_reason or reason
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            await asyncio.wait([self._task])
+
+    def iter_events(self, start=0, timeout=None):
+        """Blocking iterator over all events of this conversation, for the Streamlit script thread."""
+        return self.log.iter(start, timeout)
+
+    def to_record(self) -> dict:
+        """Everything worth keeping about this conversation, for the transcript store."""
+        turns = []
+        for turn, metrics in zip(self.turns, self.metrics):
+            record = { "side": turn.speaker, "model": turn.model, "content": turn.content }
+            timing = { "ttft": round(metrics.ttft, 3), "duration": round(metrics.duration, 3), "max_gap": round(metrics.max_gap, 3), "cached": metrics.cached,
+                       "reasoning_tokens": metrics.reasoning_tokens }
+            turns.append(dict(record, timing=timing, server=metrics.server))
+        return {
+            "conversation_id": self.id,
+            "session_id": self.session_id,
+            "started": self.started,
+            "finished": self.finished_at,
+            "models": self.models,
+            "aliases": self.aliases,
+            "settings": {
+                "system_prompts": self.system_prompts,
+                "first_side": self.first_side,
+                "initial_prompt": self.initial_prompt,
+                "max_turns": self.max_turns,
+                "use_context": self.use_context,
+            },
+            "turns": turns,
+            "error": self.error,
+        }
+
+    def compact_events(self) -> None:
+        """Keep one event per turn instead of one per token once the conversation is over. Readers still following
+        the old log keep it, new readers see the compacted events, numbered from 0 under a new log revision."""
+        if self.finished and not self._compacted:
+            self.log = self.log.compacted()
+            self._compacted = True
+
+    @property
+    def event_count(self) -> int:
+        return len(self.log.events)
+
+    @property
+    def transcript_id(self) -> str:
+        """Identifies the events as numbered now, changes when they are compacted."""
+        return f"{self.id}.{self.log.revision}"
+
+    def events_since(self, start: int) -> list:
+        """Snapshot of the events after `start`, without waiting for new ones."""
+        return self.log.events[start:]
+
+    def __aiter__(self):
+        return self.log.follow()
+
+    async def _emit(self, kind, turn=-1, side="", content="", close=False) -> None:
+        await self.log.append(EngineEvent(kind, turn, side, self.aliases.get(side, ""), content), close=close)
+
+    def _emit_soon(self, kind, turn=-1, side="", content="") -> None:
+        """_emit for synchronous callbacks on the background loop."""
+        task = asyncio.ensure_future(self._emit(kind, turn, side, content))
+        self._queue_reports.add(task)
+        task.add_done_callback(self._queue_reports.discard)
+
+    async def _run(self) -> None:
+        self._task = asyncio.current_task()
+        watchdog = asyncio.ensure_future(self._watch_page()) if self.is_alive else None
+        side = self.first_side
+        prompt = self.initial_prompt
+        if self.use_context:
+            self.history.append(OPENER, prompt)
+        try:
+            for turn in range(self.max_turns):
+                if self.cancel_reason:
+                    # cancelled before the task was known
+                    raise asyncio.CancelledError()
+                self._turn_started = time.monotonic()
+                await self._emit("turn_start", turn, side)
+                model_residency.touch(self.models[side], self.session_id)
+                if turn + 1 < self.max_turns and self.models[other_side(side)] != self.models[side]:
+                    # load the next speaker while this one is talking
+                    self._preload = model_residency.preload(self.models[other_side(side)], self.session_id)
+                message = await self._generate(turn, side, prompt)
+                self._turn_started = None
+                if self.use_context:
+                    # the reply is stored once, it is this side's answer and the other side's next prompt
+                    self.turns.append(self.history.append(side, message, self.models[side]))
+                    # summarize old turns while the other model is talking, not when this side is up again
+                    reserve = self._system_prompt_tokens(side) + context_window.PROMPT_RESERVE
+                    self._compactions[side] = asyncio.ensure_future(self.windows[side].fit(self.history.view(side), reserve))
+                else:
+                    self.turns.append(Turn(side, message, self.models[side]))
+                await self._emit("turn_end", turn, side)
+                # the reply becomes the other model's prompt
+                prompt = message
+                side = other_side(side)
+            self.finished_at = time.time()
+            await self._emit("done", close=True)
+        except asyncio.CancelledError:
+            self.finished_at = time.time()
+            self.cancel_reason = self.cancel_reason or "cancelled"
+            self.error = self.cancel_reason
+            for compaction in self._compactions.values():
+                compaction.cancel()
+            if self._preload is not None:
+                self._preload.cancel()
+            telemetry.record_cancellation(self.session_id, self._reclaimed_seconds())
+            await self._emit("cancelled", content=self.cancel_reason, close=True)
+        except Exception as e:
+            self.finished_at = time.time()
+            self.error = str(e)
+            await self._emit("error", content=str(e), close=True)
+        finally:
+            if watchdog is not None:
+                watchdog.cancel()
+        if self.on_finish:
+            self.on_finish(self)
+
+    async def _watch_page(self) -> None:
+        gone_since = None
+        while True:
+            await asyncio.sleep(LIVENESS_INTERVAL)
+            if self.is_alive():
+                gone_since = None
+                continue
+            gone_since = gone_since or time.monotonic()
+            if time.monotonic() - gone_since >= DISCONNECT_GRACE:
+                self.cancel_reason = "disconnected"
+                self._task.cancel()
+                return
+
+    def _reclaimed_seconds(self) -> float | None:
+        """Generation time the cancellation saved: the turns that will not run, at this conversation's average turn
+        time (or the models' average so far), minus what the interrupted turn had already used. None while no turn
+        of these models has finished yet, there is nothing to estimate from."""
+        durations = [metrics.duration for metrics in self.metrics]
+        if not durations:
+            durations = [telemetry.average_turn_time(model) for model in set(self.models.values())]
+            durations = [duration for duration in durations if duration]
+        if not durations:
+            return None
+        remaining_turns = self.max_turns - len(self.turns)
+        spent = time.monotonic() - self._turn_started if self._turn_started is not None else 0.0
+        return max(0.0, remaining_turns * sum(durations) / len(durations) - spent)
+
+    def _system_prompt_tokens(self, side: str) -> int:
+        system_prompt = ollama_tools.SYSTEM_WRAPPER_START + self.system_prompts[side] + ollama_tools.SYSTEM_WRAPPER_END
+        return context_window.estimate_tokens(system_prompt) + context_window.MESSAGE_OVERHEAD
+
+    async def _generate(self, turn: int, side: str, prompt: str) -> str:
+        history = self.history.view(side)
+        window = self.windows[side]
+        if side in self._compactions:
+            await self._compactions.pop(side)
+        await window.fit(history, self._system_prompt_tokens(side) + context_window.estimate_tokens(prompt) + context_window.MESSAGE_OVERHEAD)
+        reasoning = ReasoningFilter()
+        on_queue_position = lambda position: self._emit_soon("queued", turn, side, str(position))
+        stream = ollama_tools.get_llm_response_streaming_async(self.models[side], self.system_prompts[side], prompt=prompt, chat_history=window.view(history),
+                                                               session_id=self.session_id, on_queue_position=on_queue_position, reasoning=reasoning)
+        timer = telemetry.TurnTimer(self.session_id, self.models[side])
+        message = ""
+        # closing the stream on cancellation closes the HTTP response, which makes Ollama stop generating
+        async with contextlib.aclosing(stream):
+            async for chunk in stream:
+                timer.chunk(chunk)
+                content = chunk["message"]["content"]
+                if content:
+                    message += content
+                    await self._emit("token", turn, side, content)
+        self.metrics.append(timer.finish(reasoning_tokens=reasoning.dropped_tokens))
+        return message
+
+def other_side(side: str) -> str:
+    return "right" if side == "left" else "left"
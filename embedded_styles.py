@@ -1,79 +1,40 @@
+import streamlit as st
 import streamlit.components.v1 as components
-import math
-
-MESSAGE_WIDTH_PERCENTAGE = 0.8
-FONT_SIZE = 16 # px
-CONTAINER_WIDTH = 700 # px
-LINE_HEIGHT_MULTIPLIER = 1.5
-CHAR_WIDTH = 0.6 * FONT_SIZE
-MAX_LINE_WIDTH = CONTAINER_WIDTH * MESSAGE_WIDTH_PERCENTAGE
-MAX_CHARS_PER_LINE = 69
-HEIGHT_REDUCER_MULTIPLIER = 10 # when message gets to 6 lines or longer, reduce the height by this multiplier * (total_lines - 5)
-
-def estimate_content_width(text: str) -> int:
-    content_width = len(text) * CHAR_WIDTH
-    return min(content_width, MAX_LINE_WIDTH)
-
-def estimate_content_height(text: str) -> int:
-    total_lines = math.ceil(len(text) / MAX_CHARS_PER_LINE)
-    line_height = FONT_SIZE * LINE_HEIGHT_MULTIPLIER
-    content_height = total_lines * line_height # add padding
-    if total_lines > 3:
-        content_height -= HEIGHT_REDUCER_MULTIPLIER * (total_lines - 3)
-    #print(f"content_height: {content_height}, total_lines: {total_lines}")
-    return max(content_height, 32)
-
-# This function defines css styles for model response boxes, produces an html string and embeds it into the webpage for every message.
-def render_model_response(text: str, placeholder: object, model_side: str) -> None:
-
-    content_width = estimate_content_width(text)
-    content_height = estimate_content_height(text)
-
-    css = f"""
-    <style>
-    .model_response_container {{
-        margin: 0;
-        # border: 2px solid red;
-        display: flex;
-        justify-content: {model_side};
-    }}
-    .model_response {{ 
-        display: flex;
-        justify-content: center;
-        font-family: monospace;
-        padding: 0 0.5rem 0 0.5rem;
-        border-radius: 0.5rem;
-        width: {content_width}px;
-        height: {content_height}px;
-        transition: height 0.1s ease-in-out;
-        transition: width 0.1s ease-in-out;
-    }}
-    .model_response p {{
-        margin: 0.5rem;
-        padding: 0;
-        width: 100%;
-    }}
-    .model_left {{
-        background-color: #d1feff;
-    }}
-    .model_right {{
-        background-color: #fffad1;
-    }}
-    </style>
-    """
-
-    message_html = f"""
-    {css}
-    <div class="model_response_container">
-        <div class="model_response model_{model_side}">
-            <p>{text}</p>
-        </div>
-    </div>
-    """
-
-    # render the html string
-    if placeholder:
-        with placeholder.container():
-            components.html(message_html, height = content_height + FONT_SIZE * 1.5)
-    else:
-        components.html(message_html, height = content_height + FONT_SIZE * 1.5)
+import os
+
+# Streaming render settings. While a conversation runs, new text is pushed to the browser at most once per frame.
+FRAME_BUDGET = 0.1 # seconds
+
+# One custom component holds the whole transcript in the browser. It lives in a single iframe with its own
+# stylesheet, bubbles size themselves with css, and every update only carries events the page hasn't seen yet.
+_transcript_component = components.declare_component("transcript", path=os.path.join(os.path.dirname(__file__), "transcript"))
+
+def encode_deltas(events: list) -> list[list]:
+    """Compact engine events into the deltas the transcript component applies: [kind, side, alias, text].
+    Consecutive tokens of a turn are merged into one delta."""
+    deltas = []
+    for event in events:
+        if event.kind == "token" and deltas and deltas[-1][0] == "token":
+            deltas[-1][3] += event.content
+        else:
+            deltas.append([event.kind, event.side, event.alias, event.content])
+    return deltas
+
+def render_transcript(engine: object, state: dict, height: int, key="transcript") -> int:
+    """Send the events of `engine` that the browser doesn't have yet. `state` is a per-session dict that keeps track
+    of what was sent. Returns the number of events sent in this call."""
+    conversation = engine.transcript_id if engine else None
+    if "sent" not in state or state.get("conversation") != conversation:
+        state.update(conversation=conversation, sent=0)
+
+    # the component asks for a resend when it missed a delta, e.g. after its iframe was remounted
+    reply = st.session_state.get(key)
+    if reply and reply != state.get("reply") and reply.get("conversation") == conversation:
+        state["reply"] = reply
+        state["sent"] = min(reply["applied"], state["sent"])
+
+    base = state["sent"]
+    events = engine.events_since(base) if engine else []
+    _transcript_component(conversation=conversation, base=base, end=base + len(events), deltas=encode_deltas(events), height=height, key=key, default=None)
+    state["sent"] = base + len(events)
+    return len(events)
@@ -0,0 +1,140 @@
+import os
+import asyncio
+import contextlib
+import time
+from dataclasses import dataclass, field
+import background_loop
+import ollama_tools
+import scheduler
+import telemetry
+import conversation_engine
+from reasoning_filter import ReasoningFilter
+
+MAX_MODELS = int(os.environ.get("TALKING_HEADS_FAN_OUT_MODELS", 8)) # models one prompt can be sent to
+
+@dataclass
+class FanOutReply:
+    alias: str
+    model: str
+    text: str = ""
+    status: str = "queued" # "queued", "streaming", "done", "error" or "cancelled"
+    position: int | None = None # place in the server queue while waiting
+    queue_wait: float = 0.0 # seconds waited for the server, not part of the metrics
+    error: str = ""
+    metrics: telemetry.TurnMetrics | None = None
+    reasoning: ReasoningFilter = field(default_factory=ReasoningFilter)
+
+    def tokens_per_second(self) -> float | None:
+        if self.metrics is None:
+            return None
+        server = self.metrics.server
+        if server.get("eval_duration"):
+            return server["eval_count"] / (server["eval_duration"] / 1e9)
+        # cached replies have no server numbers, count chunks instead
+        streaming_time = self.metrics.duration - self.metrics.ttft
+        return self.metrics.chunks / streaming_time if streaming_time > 0 else None
+
+class FanOut:
+    """Sends one prompt to several models at once on the background loop. Every reply streams into its own
+    FanOutReply, which pages read while it grows; the comparison takes as long as the slowest model, as far as
+    the scheduler's slots allow them to run side by side. Replies wait in a queue of their own, so a conversation
+    running in the same session doesn't count against it, and never queue more requests than the scheduler takes
+    from one session."""
+
+    def __init__(self, models: dict[str, str], system_prompt: str, prompt: str, session_id: str, is_alive=None):
+        self.replies = [FanOutReply(alias, model) for alias, model in models.items()] # { "alias": "model_name" }
+        self.system_prompt = system_prompt
+        self.prompt = prompt
+        self.session_id = session_id
+        self.queue_id = f"{session_id}-fan-out"
+        self.is_alive = is_alive # returns False once nobody is watching, checked from the background loop
+        self.disconnected = False
+        self.started = None
+        self.finished_at = None
+        self._future = None
+        self._task = None
+
+    @property
+    def finished(self) -> bool:
+        return self._future is not None and self._future.done()
+
+    @property
+    def wall_time(self) -> float:
+        if self.started is None:
+            return 0.0
+        return (self.finished_at or time.monotonic()) - self.started
+
+    def start(self) -> "FanOut":
+        if self._future is None:
+            self.started = time.monotonic()
+            self._future = background_loop.submit(self._run())
+        return self
+
+    def cancel(self, timeout=5) -> None:
+        """Stop all replies that are still streaming, closing their HTTP streams. Returns once they stopped."""
+        if self._future is None or self._future.done():
+            return
+        try:
+            background_loop.run(self._cancel(), timeout)
+        except TimeoutError:
+            print(f"Fan-out did not stop within {timeout} seconds")
+
+    async def _cancel(self) -> None:
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            await asyncio.wait([self._task])
+
+    async def _run(self) -> None:
+        self._task = asyncio.current_task()
+        watchdog = asyncio.ensure_future(self._watch_page()) if self.is_alive else None
+        try:
+            queued = asyncio.Semaphore(scheduler.MAX_QUEUED_PER_SESSION)
+            await asyncio.gather(*(self._stream(reply, queued) for reply in self.replies))
+        except asyncio.CancelledError:
+            for reply in self.replies:
+                if reply.status in ("queued", "streaming"):
+                    reply.status = "cancelled"
+        finally:
+            if watchdog is not None:
+                watchdog.cancel()
+        self.finished_at = time.monotonic()
+
+    async def _watch_page(self) -> None:
+        # same rules as a conversation: a page that stays gone for the grace period no longer needs the replies
+        gone_since = None
+        while True:
+            await asyncio.sleep(conversation_engine.LIVENESS_INTERVAL)
+            if self.is_alive():
+                gone_since = None
+                continue
+            gone_since = gone_since or time.monotonic()
+            if time.monotonic() - gone_since >= conversation_engine.DISCONNECT_GRACE:
+                self.disconnected = True
+                self._task.cancel()
+                return
+
+    async def _stream(self, reply: FanOutReply, queued: asyncio.Semaphore) -> None:
+        requested = time.monotonic()
+        def on_queue_position(position):
+            reply.position = position
+        def on_granted():
+            # time spent behind the other models is not the model's speed
+            reply.queue_wait = time.monotonic() - requested
+            timer.restart()
+        try:
+            async with queued:
+                timer = telemetry.TurnTimer(self.session_id, reply.model)
+                stream = ollama_tools.get_llm_response_streaming_async(reply.model, self.system_prompt, self.prompt, chat_history=[],
+                                                                       session_id=self.queue_id, on_queue_position=on_queue_position,
+                                                                       reasoning=reply.reasoning, on_granted=on_granted)
+                async with contextlib.aclosing(stream):
+                    async for chunk in stream:
+                        timer.chunk(chunk)
+                        reply.status = "streaming"
+                        reply.text += chunk["message"]["content"]
+            reply.metrics = timer.finish(reasoning_tokens=reply.reasoning.dropped_tokens)
+            reply.status = "done"
+        except Exception as e:
+            # one failing model doesn't stop the others
+            reply.status = "error"
+            reply.error = str(e)
@@ -0,0 +1,152 @@
+import os
+import re
+import json
+import time
+import threading
+from dataclasses import dataclass
+import ollama_client
+
+# Installed models with their metadata, fetched once per process and refreshed in the background when stale.
+CATALOG_TTL = 5 * 60 # seconds
+# Display names, first matching pattern wins. Override with a json list of [pattern, alias] pairs.
+DEFAULT_ALIAS_RULES = [
+    ["phi3", "Phi"],
+    ["qwen", "Qwen"],
+    ["wizard", "Wizard"],
+    ["dolphin3", "Dolphin"],
+    ["dolphin-mistral", "Mistral"],
+    ["llama3", "Llama"],
+]
+ALIAS_RULES_FILE = os.environ.get("TALKING_HEADS_ALIAS_RULES")
+# Memory the models of one conversation may take together, pairs above it will swap. Unset means no check.
+MODEL_RAM_BUDGET = float(os.environ.get("TALKING_HEADS_MODEL_RAM_GB", 0)) * 1024 ** 3
+
+def _load_alias_rules() -> list[tuple[re.Pattern, str]]:
+    rules = DEFAULT_ALIAS_RULES
+    if ALIAS_RULES_FILE:
+        with open(ALIAS_RULES_FILE, "r") as f:
+            rules = json.load(f)
+    return [(re.compile(pattern), alias) for pattern, alias in rules]
+
+ALIAS_RULES = _load_alias_rules() # compiled once
+
+@dataclass
+class ModelInfo:
+    name: str
+    alias: str
+    size: int = 0 # bytes, roughly what the weights take in memory
+    parameter_size: str = ""
+    quantization: str = ""
+    context_length: int = 0
+
+    def describe(self) -> str:
+        details = [detail for detail in (self.parameter_size, self.quantization) if detail]
+        if self.size:
+            details.append(f"{self.size / 1024 ** 3:.1f} GB")
+        if self.context_length:
+            details.append(f"{self.context_length} ctx")
+        return f"{self.alias}: {', '.join(details)}" if details else self.alias
+
+def alias_for(model_name: str) -> str:
+    for pattern, alias in ALIAS_RULES:
+        if pattern.search(model_name):
+            return alias
+    # models without a rule get a name from their own, instead of being left out
+    return model_name.split(":")[0].split("/")[-1].replace("-", " ").title()
+
+def assign_aliases(model_names: list[str]) -> dict[str, str]:
+    model_data = {}
+    for model in model_names:
+        alias = alias_for(model)
+        if alias in model_data:
+            alias = f"{alias} {model.split(':')[-1]}" # two tags of the same family
+        model_data[alias] = model
+    return model_data
+
+class ModelCatalog:
+    def __init__(self, ttl=CATALOG_TTL):
+        self.ttl = ttl
+        self.models = {} # { "alias": ModelInfo }
+        self.updated = 0.0
+        self._show_cache = {} # { ("model_name", "digest"): (parameter_size, quantization, context_length) }
+        self._lock = threading.Lock()
+        self._refreshing = False
+
+    def get(self) -> dict[str, ModelInfo]:
+        """Current catalog. The first call loads it, later calls never wait: a stale catalog is returned while
+        a background thread refreshes it."""
+        if not self.models:
+            self.refresh()
+        elif time.monotonic() - self.updated > self.ttl and not self._refreshing:
+            self._refreshing = True
+            threading.Thread(target=self.refresh, name="model-catalog-refresh", daemon=True).start()
+        return self.models
+
+    def aliases(self) -> dict[str, str]:
+        """{ "alias": "model_name" }"""
+        return { alias: info.name for alias, info in self.get().items() }
+
+    def info(self, model_name: str) -> ModelInfo | None:
+        """Metadata of a model from the cached catalog, without loading or refreshing it."""
+        for info in self.models.values():
+            if info.name == model_name:
+                return info
+        return None
+
+    def refresh(self) -> None:
+        try:
+            listed = ollama_client.list_model_details()
+            aliases = assign_aliases([model.model for model in listed])
+            by_name = { model.model: model for model in listed }
+            models = {}
+            for alias, name in aliases.items():
+                model = by_name[name]
+                info = ModelInfo(name, alias, size=model.size or 0)
+                info.parameter_size, info.quantization, info.context_length = self._details(model)
+                models[alias] = info
+            with self._lock:
+                self.models = models
+                self.updated = time.monotonic()
+        except Exception as e:
+            if not self.models:
+                raise
+            print(f"Could not refresh the model catalog: {e}")
+        finally:
+            self._refreshing = False
+
+    def _details(self, model) -> tuple[str, str, int]:
+        # /api/show is only asked once per model version
+        key = (model.model, model.digest)
+        if key not in self._show_cache:
+            context_length = 0
+            try:
+                shown = ollama_client.show(model.model)
+                for field, value in (shown.modelinfo or {}).items():
+                    if field.endswith(".context_length"):
+                        context_length = int(value)
+            except Exception as e:
+                print(f"Could not read metadata of {model.model}: {e}")
+            details = model.details
+            parameter_size = details.parameter_size if details and details.parameter_size else ""
+            quantization = details.quantization_level if details and details.quantization_level else ""
+            self._show_cache[key] = (parameter_size, quantization, context_length)
+        return self._show_cache[key]
+
+    def pair_fits(self, model_a: str, model_b: str) -> bool:
+        """Whether two models can stay loaded together within MODEL_RAM_BUDGET."""
+        if not MODEL_RAM_BUDGET:
+            return True
+        sizes = [info.size for info in (self.info(model_a), self.info(model_b)) if info]
+        if model_a == model_b:
+            sizes = sizes[:1]
+        return sum(sizes) <= MODEL_RAM_BUDGET
+
+_catalog = None
+_catalog_lock = threading.Lock()
+
+def get_catalog() -> ModelCatalog:
+    global _catalog
+    with _catalog_lock:
+        if _catalog is None:
+            _catalog = ModelCatalog()
+    return _catalog
@@ -0,0 +1,117 @@
+import os
+import re
+import math
+import time
+import asyncio
+import background_loop
+import ollama_client
+
+# Keeps the models of active conversations loaded in Ollama. Models are loaded as soon as they are picked, stay
+# resident while any session uses them and are unloaded once every session using them has gone idle.
+KEEP_ALIVE = os.environ.get("OLLAMA_KEEP_ALIVE", "30m") # sent with every request, so Ollama won't evict a model mid-conversation
+IDLE_TIMEOUT = 15 * 60 # seconds without any session using a model before it is released
+REAP_INTERVAL = 60 # seconds between idle checks
+MAX_LOADS = 1 # loads sent at once; they run beside the generations, outside the scheduler's slots
+DURATION_UNITS = { "ms": 0.001, "s": 1, "m": 60, "h": 3600 }
+
+def _duration_seconds(value: str) -> float:
+    """An Ollama keep_alive value in seconds: "30m", "1h30m", "90s" or a plain number of seconds. Negative is forever."""
+    value = value.strip()
+    if value.startswith("-"):
+        return math.inf
+    try:
+        return float(value)
+    except ValueError:
+        return sum(float(amount) * DURATION_UNITS[unit] for amount, unit in re.findall(r"(\d+(?:\.\d+)?)(ms|h|m|s)", value))
+
+RESIDENT_FOR = _duration_seconds(KEEP_ALIVE) # how long Ollama keeps a model after the last request that used it
+
+_users = {} # { "model_name": { "session_id": last_used } }
+_last_request = {} # { "model_name": time the last request that loaded or used it was sent }
+_loading = {} # { "model_name": asyncio.Task }
+_waiting = {} # { "model_name": number of warm_async calls waiting for its load }
+_load_limit = None
+_reaper = None
+
+def warm(model: str, session_id: str) -> None:
+    """Start loading a model in the background, for sync callers such as Streamlit widget callbacks."""
+    if model:
+        background_loop.submit(warm_async(model, session_id))
+
+async def warm_async(model: str, session_id: str) -> None:
+    _register(model, session_id)
+    if is_resident(model):
+        return
+    task = _loading.get(model)
+    if task is None or task.done():
+        task = asyncio.ensure_future(_load(model))
+        _loading[model] = task
+    _waiting[model] = _waiting.get(model, 0) + 1
+    try:
+        await asyncio.shield(task)
+    except asyncio.CancelledError:
+        if _waiting[model] == 1:
+            task.cancel() # nobody else waits for this load
+        raise
+    except Exception as e:
+        # warming is best effort, the chat request itself will surface a real problem
+        print(f"Could not warm up {model}: {e}")
+    finally:
+        _waiting[model] -= 1
+        if not _waiting[model]:
+            del _waiting[model]
+
+def preload(model: str, session_id: str) -> asyncio.Task:
+    """Load a model without waiting for it, must be called on the background loop. Cancelling the returned task
+    cancels the load too, unless another session is waiting for it."""
+    return asyncio.ensure_future(warm_async(model, session_id))
+
+def touch(model: str, session_id: str) -> None:
+    """Record that a session is sending a request for a model right now, which loads it and keeps it loaded."""
+    _register(model, session_id)
+    _last_request[model] = time.monotonic()
+
+def is_resident(model: str) -> bool:
+    """Whether Ollama should still have the model loaded, judging by the last request sent for it."""
+    last_request = _last_request.get(model)
+    return last_request is not None and time.monotonic() - last_request < RESIDENT_FOR
+
+def _register(model: str, session_id: str) -> None:
+    _users.setdefault(model, {})[session_id] = time.monotonic()
+    _ensure_reaper()
+
+async def _load(model: str) -> None:
+    global _load_limit
+    if _load_limit is None:
+        _load_limit = asyncio.Semaphore(MAX_LOADS) # created on first use so that it binds to the background loop
+    # not in a scheduler slot: a load has to run while the other model is still streaming to save any time
+    async with _load_limit:
+        if is_resident(model):
+            return # a chat request loaded it while this one waited
+        # an empty prompt makes Ollama load the model without generating anything
+        await ollama_client.with_retries_async(ollama_client.get_async_client().generate, model=model, prompt="", keep_alive=KEEP_ALIVE)
+        _last_request[model] = time.monotonic()
+
+async def _unload(model: str) -> None:
+    await ollama_client.get_async_client().generate(model=model, prompt="", keep_alive=0)
+
+def _ensure_reaper() -> None:
+    global _reaper
+    if _reaper is None or _reaper.done():
+        _reaper = asyncio.ensure_future(_reap_idle_models())
+
+async def _reap_idle_models() -> None:
+    while _users:
+        await asyncio.sleep(REAP_INTERVAL)
+        now = time.monotonic()
+        for model, sessions in list(_users.items()):
+            for session_id, last_used in list(sessions.items()):
+                if now - last_used > IDLE_TIMEOUT:
+                    del sessions[session_id]
+            if not sessions:
+                del _users[model]
+                _last_request.pop(model, None)
+                try:
+                    await _unload(model)
+                except Exception as e:
+                    print(f"Could not unload {model}: {e}")
@@ -0,0 +1,116 @@
+import os
+import time
+import asyncio
+import threading
+import httpx
+import ollama
+
+# Process-wide connection to the Ollama server. Every session shares the same pooled, keep-alive clients
+# instead of opening a new connection per request.
+OLLAMA_HOST = os.environ.get("OLLAMA_HOST", "http://localhost:11434")
+CONNECT_TIMEOUT = float(os.environ.get("OLLAMA_CONNECT_TIMEOUT", 5)) # seconds
+REQUEST_TIMEOUT = float(os.environ.get("OLLAMA_REQUEST_TIMEOUT", 300)) # seconds, also the longest wait between two streamed chunks
+MAX_RETRIES = 3
+RETRY_BACKOFF = 0.5 # seconds before the first retry, doubles after every attempt
+POOL_LIMITS = httpx.Limits(max_connections=32, max_keepalive_connections=16, keepalive_expiry=60)
+
+# Errors raised while connecting, before the server has seen a request, so a retry can't run a generation twice.
+# ollama turns httpx.ConnectError into ConnectionError. A broken response (httpx.RemoteProtocolError) is not retried,
+# the server may already have generated it.
+RETRYABLE_ERRORS = (ConnectionError, httpx.ConnectError, httpx.ConnectTimeout)
+
+_clients = {} # { request timeout: client }, one pool per timeout since httpx sets it per client
+_async_clients = {} # one per event loop, an httpx async pool can't be shared across loops
+_clients_lock = threading.Lock()
+
+def _client_options(timeout=REQUEST_TIMEOUT) -> dict:
+    return {
+        "timeout": httpx.Timeout(timeout, connect=min(CONNECT_TIMEOUT, timeout)),
+        "limits": POOL_LIMITS,
+    }
+
+def get_client(timeout=REQUEST_TIMEOUT) -> ollama.Client:
+    """Shared synchronous client whose requests give up after `timeout` seconds."""
+    with _clients_lock:
+        if timeout not in _clients:
+            _clients[timeout] = ollama.Client(host=OLLAMA_HOST, **_client_options(timeout))
+        return _clients[timeout]
+
+def get_async_client() -> ollama.AsyncClient:
+    """Shared asynchronous client for the running event loop."""
+    loop = asyncio.get_running_loop()
+    with _clients_lock:
+        if loop not in _async_clients:
+            _async_clients[loop] = ollama.AsyncClient(host=OLLAMA_HOST, **_client_options())
+        return _async_clients[loop]
+
+def with_retries(func, *args, retries=MAX_RETRIES, **kwargs):
+    """Call func, retrying with exponential backoff while the server can't be reached."""
+    delay = RETRY_BACKOFF
+    for attempt in range(retries + 1):
+        try:
+            return func(*args, **kwargs)
+        except RETRYABLE_ERRORS:
+            if attempt == retries:
+                raise
+            time.sleep(delay)
+            delay *= 2
+
+async def with_retries_async(func, *args, retries=MAX_RETRIES, **kwargs):
+    """Async version of with_retries, func must return an awaitable."""
+    delay = RETRY_BACKOFF
+    for attempt in range(retries + 1):
+        try:
+            return await func(*args, **kwargs)
+        except RETRYABLE_ERRORS:
+            if attempt == retries:
+                raise
+            await asyncio.sleep(delay)
+            delay *= 2
+
+def list_models(retries=MAX_RETRIES, timeout=REQUEST_TIMEOUT) -> list[str]:
+    response = with_retries(get_client(timeout).list, retries=retries)
+    return [model.model for model in response.models]
+
+def list_model_details(retries=MAX_RETRIES) -> list:
+    """Installed models as reported by /api/tags, with size and details."""
+    return with_retries(get_client().list, retries=retries).models
+
+def show(model: str) -> ollama.ShowResponse:
+    return with_retries(get_client().show, model)
+
+def chat(model: str, messages: list[dict], **kwargs) -> ollama.ChatResponse:
+    return with_retries(get_client().chat, model=model, messages=messages, **kwargs)
+
+async def achat(model: str, messages: list[dict], **kwargs) -> ollama.ChatResponse:
+    return await with_retries_async(get_async_client().chat, model=model, messages=messages, **kwargs)
+
+def chat_stream(model: str, messages: list[dict], **kwargs):
+    """Streaming chat. Connecting is retried, a stream that already produced chunks is not."""
+    def open_stream():
+        stream = get_client().chat(model=model, messages=messages, stream=True, **kwargs)
+        # the request is only sent once the first chunk is pulled
+        return stream, next(stream, None)
+
+    stream, first_chunk = with_retries(open_stream)
+    try:
+        if first_chunk is not None:
+            yield first_chunk
+        yield from stream
+    finally:
+        stream.close()
+
+async def achat_stream(model: str, messages: list[dict], **kwargs):
+    """Async streaming chat, same retry rules as chat_stream."""
+    async def open_stream():
+        stream = await get_async_client().chat(model=model, messages=messages, stream=True, **kwargs)
+        return stream, await anext(stream, None)
+
+    stream, first_chunk = await with_retries_async(open_stream)
+    try:
+        if first_chunk is not None:
+            yield first_chunk
+        async for chunk in stream:
+            yield chunk
+    finally:
+        await stream.aclose()
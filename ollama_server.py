@@ -0,0 +1,113 @@
+import os
+import time
+import shutil
+import atexit
+import threading
+import subprocess
+import ollama_client
+
+# Lifecycle of the local Ollama server, shared by every session in the process. Readiness is cached and kept up to
+# date by a background health check, so page reruns never wait on a network round trip.
+OLLAMA_BIN = os.environ.get("OLLAMA_BIN") # explicit path to the ollama binary, otherwise PATH is searched
+MACOS_APP_BINARY = "/Applications/Ollama.app/Contents/MacOS/ollama"
+STARTUP_TIMEOUT = 30 # seconds
+STARTUP_BACKOFF = 0.1 # seconds before the first readiness check, doubles up to MAX_STARTUP_BACKOFF
+MAX_STARTUP_BACKOFF = 2.0
+HEALTH_INTERVAL = 10 # seconds between background health checks
+HEALTH_TIMEOUT = 5 # seconds a health check waits for an answer, a hung server counts as down
+
+def find_binary() -> str | None:
+    if OLLAMA_BIN:
+        return OLLAMA_BIN
+    on_path = shutil.which("ollama")
+    if on_path:
+        return on_path
+    if os.path.exists(MACOS_APP_BINARY):
+        return MACOS_APP_BINARY
+    return None
+
+def is_responding() -> bool:
+    try:
+        ollama_client.list_models(retries=0, timeout=HEALTH_TIMEOUT)
+        return True
+    except Exception:
+        return False
+
+class OllamaServer:
+    """Attaches to a running server or starts one, then watches it from a daemon thread."""
+
+    def __init__(self):
+        self.process = None # only set when this process started the server
+        self.ready = False
+        self._lock = threading.Lock()
+        self._monitor = None
+
+    def ensure_started(self, timeout=STARTUP_TIMEOUT) -> None:
+        """Return at once if the server is known to be up, otherwise attach to it or start it.
+        Raises RuntimeError if it doesn't become ready within `timeout` seconds."""
+        if self.ready:
+            return
+        with self._lock:
+            if self.ready:
+                return
+            if not is_responding():
+                self._start()
+                self._wait_until_ready(timeout)
+            self.ready = True
+            self._start_monitor()
+
+    def _start(self) -> None:
+        if self.process is not None and self.process.poll() is None:
+            return # started earlier and still booting
+        binary = find_binary()
+        if binary is None:
+            raise RuntimeError("Ollama is not running and no ollama binary was found. Set OLLAMA_BIN or add it to PATH.")
+        self.process = subprocess.Popen([binary, "serve"])
+
+    def _wait_until_ready(self, timeout: float) -> None:
+        deadline = time.monotonic() + timeout
+        delay = STARTUP_BACKOFF
+        while time.monotonic() < deadline:
+            if is_responding():
+                return
+            if self.process is not None and self.process.poll() is not None:
+                raise RuntimeError(f"Ollama exited during startup with code {self.process.returncode}.")
+            time.sleep(min(delay, max(0.0, deadline - time.monotonic())))
+            delay = min(delay * 2, MAX_STARTUP_BACKOFF)
+        raise RuntimeError(f"Ollama server did not become ready in {timeout} seconds.")
+
+    def _start_monitor(self) -> None:
+        if self._monitor is None or not self._monitor.is_alive():
+            self._monitor = threading.Thread(target=self._watch, name="ollama-health", daemon=True)
+            self._monitor.start()
+
+    def _watch(self) -> None:
+        while True:
+            time.sleep(HEALTH_INTERVAL)
+            self.ready = is_responding()
+            if not self.ready:
+                # the next page run will attach again or restart the server
+                return
+
+    def stop(self) -> None:
+        """Stop the server if this process started it."""
+        with self._lock:
+            self.ready = False
+            if self.process is not None and self.process.poll() is None:
+                self.process.terminate()
+                try:
+                    self.process.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    self.process.kill()
+            self.process = None
+
+_server = None
+_server_lock = threading.Lock()
+
+def get_server() -> OllamaServer:
+    global _server
+    with _server_lock:
+        if _server is None:
+            _server = OllamaServer()
+            atexit.register(_server.stop)
+    return _server
@@ -1,12 +1,16 @@
-import ollama
-import requests
-import subprocess
+import ollama_client
+import ollama_server
+import model_catalog
+import model_residency
+import response_cache
+import reasoning_filter
+from reasoning_filter import ReasoningFilter
+import scheduler
+import background_loop
 import random
 import pprint
-import re
 import json
 
-ollama_process = None
 SYSTEM_WRAPPER_START = "You are assigned the following role or set of instructions: \n"
 SYSTEM_WRAPPER_END = """
                     \nYour behavior must strictly follow these guidelines:
@@ -16,40 +20,21 @@ SYSTEM_WRAPPER_END = """
                     - Don't repeat yourself. Make sure you responses don't echo what you've already said.
                     - Keep your responses under 50 words.
                     """
+DEFAULT_SESSION = "default" # requests that don't say which session they belong to share one scheduler queue
 DEFAULT_SYSTEM_PROMPT_LEFT = "You are an absolute coffee fanatic. You advocate for everyone to drink coffee. When you hear positive things about other drinks, you get angry, because you think there is nothing better than coffee."
 DEFAULT_SYSTEM_PROMPT_RIGHT = "You are an absolute tea fanatic. You advocate for everyone to drink tea. When you hear positive things about other drinks, you get angry, because you think there is nothing better than tea."
 
 def start_ollama():
-    global ollama_process
-    if ollama_process is None:
-        ollama_process = subprocess.Popen(["/Applications/Ollama.app/Contents/MacOS/ollama", "serve"])
+    ollama_server.get_server().ensure_started()
 
 def stop_ollama():
-    global ollama_process
-    if ollama_process:
-        ollama_process.terminate()
-        ollama_process = None
+    ollama_server.get_server().stop()
 
 def get_models():
-    response = requests.get("http://localhost:11434/api/tags").json()
-    models = [model["name"] for model in response["models"]]
-    return models
+    return ollama_client.list_models()
 
 def assign_model_aliases(model_names: list[str]) -> dict[str, str]:
-    model_data = {}
-    for model in model_names:
-        if "phi3" in model:
-            model_data["Phi"] = model
-        elif "qwen" in model:
-            model_data["Qwen"] = model
-        elif "wizard" in model:
-            model_data["Wizard"] = model
-        elif "dolphin3" in model:
-            model_data["Dolphin"] = model
-        elif "dolphin-mistral" in model:
-            model_data["Mistral"] = model
-        elif "llama3" in model:
-            model_data["Llama"] = model
+    model_data = model_catalog.assign_aliases(model_names)
     print(model_data)
     return model_data
 
@@ -63,12 +48,17 @@ def split_models_into_groups(model_data: dict[str, str]) -> tuple[dict[str, str]
     right_group = {key: model_data[key] for key in right_keys}
     return left_group, right_group
 
-def get_llm_response(model, system_prompt, prompt):
-    raw_response = ollama.chat(model=model, messages=[{"role": "system", "content": SYSTEM_WRAPPER_START + system_prompt + SYSTEM_WRAPPER_END}, {"role": 'user', "content": prompt}])
-    model_response = raw_response['message']['content']
+def get_llm_response(model, system_prompt, prompt, session_id=DEFAULT_SESSION):
+    messages = [{"role": "system", "content": SYSTEM_WRAPPER_START + system_prompt + SYSTEM_WRAPPER_END}, {"role": 'user', "content": prompt}]
+    ticket = background_loop.run(scheduler.get_scheduler().acquire(session_id, model))
+    try:
+        raw_response = ollama_client.chat(model, messages=messages)
+    finally:
+        background_loop.get_loop().call_soon_threadsafe(scheduler.get_scheduler().release, ticket)
+    model_response = remove_reasoning(raw_response['message']['content'])
     return model_response
 
-def get_llm_response_streaming(model, system_prompt, prompt, chat_history):
+def build_chat_messages(system_prompt, prompt, chat_history):
     full_system_prompt = SYSTEM_WRAPPER_START + "*" + system_prompt + "*" + SYSTEM_WRAPPER_END
     print(f"\n\n{full_system_prompt}\n\n")
     system_message = {"role": "system", "content": full_system_prompt} # goes 1st
@@ -76,8 +66,62 @@ def get_llm_response_streaming(model, system_prompt, prompt, chat_history):
     messages = [ system_message ]
     messages.extend(chat_history)
     messages.append(user_message)
-    streamed_response = ollama.chat(model=model, messages=messages, stream=True)                          
-    return streamed_response
+    return messages
+
+def get_llm_response_streaming(model, system_prompt, prompt, chat_history, session_id=DEFAULT_SESSION, reasoning=None):
+    """Stream a reply. Reasoning is stripped from the chunks unless disabled; pass a ReasoningFilter as `reasoning`
+    to read how much of it was dropped."""
+    messages = build_chat_messages(system_prompt, prompt, chat_history)
+    options = {}
+    if response_cache.CACHE_ENABLED:
+        key = response_cache.make_key(model, messages, response_cache.CACHE_OPTIONS)
+        cached_chunks = response_cache.get_cache().get(key)
+        if cached_chunks is not None:
+            return _without_reasoning(response_cache.replay(model, cached_chunks), reasoning)
+        options = response_cache.CACHE_OPTIONS
+    open_stream = lambda: ollama_client.chat_stream(model, messages, options=options, keep_alive=model_residency.KEEP_ALIVE)
+    streamed_response = scheduler.scheduled_stream_sync(session_id, model, open_stream)
+    if response_cache.CACHE_ENABLED:
+        streamed_response = response_cache.record(key, streamed_response)
+    return _without_reasoning(streamed_response, reasoning)
+
+def get_llm_response_streaming_async(model, system_prompt, prompt, chat_history, session_id=DEFAULT_SESSION, on_queue_position=None, reasoning=None,
+                                     on_granted=None):
+    """Same as get_llm_response_streaming, but returns an async iterator for code running on the background loop.
+    on_queue_position(position) is called while the request waits for the server, on_granted() once it is sent."""
+    messages = build_chat_messages(system_prompt, prompt, chat_history)
+    options = response_cache.CACHE_OPTIONS if response_cache.CACHE_ENABLED else {}
+    open_stream = lambda: ollama_client.achat_stream(model, messages, options=options, keep_alive=model_residency.KEEP_ALIVE)
+    open_scheduled = lambda: scheduler.scheduled_stream(session_id, model, open_stream, on_queue_position, on_granted)
+    if response_cache.CACHE_ENABLED:
+        key = response_cache.make_key(model, messages, options)
+        return _without_reasoning_async(response_cache.acached(key, model, open_scheduled), reasoning)
+    return _without_reasoning_async(open_scheduled(), reasoning)
+
+def _without_reasoning(stream, reasoning):
+    # the cache keeps raw replies, reasoning is filtered on the way out
+    if not reasoning_filter.STRIP_REASONING:
+        return stream
+    return reasoning_filter.filter_stream(stream, reasoning or ReasoningFilter())
+
+def _without_reasoning_async(stream, reasoning):
+    if not reasoning_filter.STRIP_REASONING:
+        return stream
+    return reasoning_filter.afilter_stream(stream, reasoning or ReasoningFilter())
+
+SUMMARY_INSTRUCTIONS = """You keep a running summary of a conversation between you and another speaker.
+Merge the new messages into the current summary. Keep the positions and arguments of both sides, drop repetition.
+Keep the summary under 100 words and reply with the summary only."""
+
+async def summarize_history_async(model, summary, messages, session_id=DEFAULT_SESSION):
+    """Fold `messages` into an existing rolling summary, returns the new summary."""
+    speakers = {"user": "Other speaker", "assistant": "You"}
+    new_messages = "\n".join(f"{speakers.get(m['role'], m['role'])}: {m['content']}" for m in messages)
+    prompt = f"Current summary:\n{summary or '(empty)'}\n\nNew messages:\n{new_messages}"
+    async with scheduler.get_scheduler().slot(session_id, model):
+        response = await ollama_client.achat(model, messages=[{"role": "system", "content": SUMMARY_INSTRUCTIONS}, {"role": "user", "content": prompt}], keep_alive=model_residency.KEEP_ALIVE)
+    return remove_reasoning(response['message']['content']).strip()
 
 def remove_reasoning(response):
-    return re.sub(r'<think>.*?</think>', '', response, flags=re.DOTALL)
\ No newline at end of file
+    reasoning = ReasoningFilter()
+    return reasoning.feed(response) + reasoning.flush()
\ No newline at end of file
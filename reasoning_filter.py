@@ -0,0 +1,95 @@
+import os
+
+# Reasoning models (qwen3, deepseek-r1, ...) think out loud between <think> tags before they answer. The reasoning is
+# removed while the reply streams in, so it is never shown, kept in the history or handed to the other model.
+STRIP_REASONING = os.environ.get("TALKING_HEADS_STRIP_REASONING", "1") == "1"
+OPEN_TAG = "<think>"
+CLOSE_TAG = "</think>"
+
+def _partial_tag_length(text: str, tag: str) -> int:
+    """Length of the longest end of `text` that could be the start of `tag`."""
+    for length in range(min(len(text), len(tag) - 1), 0, -1):
+        if tag.startswith(text[-length:]):
+            return length
+    return 0
+
+class ReasoningFilter:
+    """Incremental filter for one reply. Text is fed chunk by chunk as it arrives; a tag split across chunks is held
+    back until the next chunk tells whether it is one. Whitespace right after a reasoning block is dropped too."""
+
+    def __init__(self):
+        self.in_reasoning = False
+        self.dropped_chars = 0
+        self.dropped_tokens = 0 # chunks that were (partly) reasoning, Ollama streams about one token per chunk
+        self._pending = "" # possible start of a tag
+        self._pending_chunks = 0 # chunks with text in _pending that weren't counted in dropped_tokens yet
+        self._skip_whitespace = False
+
+    def feed(self, text: str) -> str:
+        """Visible part of the next chunk."""
+        carried, carried_chunks = self._pending, self._pending_chunks
+        chunk_length = len(text)
+        # held back text is dropped with the reasoning around it, or outside reasoning if it did start a tag
+        carried_droppable = self.in_reasoning or (carried + text).startswith(OPEN_TAG)
+        text = carried + text
+        self._pending, self._pending_chunks = "", 0
+        dropped_before = self.dropped_chars
+        visible = []
+        while text:
+            tag = CLOSE_TAG if self.in_reasoning else OPEN_TAG
+            index = text.find(tag)
+            if index == -1:
+                held = _partial_tag_length(text, tag)
+                self._take(text[:len(text) - held], visible)
+                self._pending = text[len(text) - held:]
+                break
+            self._take(text[:index], visible)
+            self.dropped_chars += len(tag)
+            self.in_reasoning = not self.in_reasoning
+            self._skip_whitespace = not self.in_reasoning
+            text = text[index + len(tag):]
+        still_held = len(self._pending) > chunk_length
+        if carried and carried_droppable and not still_held:
+            self.dropped_tokens += carried_chunks
+            dropped_before += len(carried)
+        if self.dropped_chars > dropped_before:
+            self.dropped_tokens += 1
+        elif self._pending:
+            # the chunk is counted once it is known whether its held back text is dropped
+            self._pending_chunks = 1 + (carried_chunks if still_held else 0)
+        return "".join(visible)
+
+    def flush(self) -> str:
+        """Visible text still held back, once the reply is complete. An unterminated reasoning block is dropped."""
+        if self.in_reasoning:
+            self.dropped_tokens += self._pending_chunks
+        visible = []
+        self._take(self._pending, visible)
+        self._pending, self._pending_chunks = "", 0
+        return "".join(visible)
+
+    def _take(self, text: str, visible: list) -> None:
+        if self.in_reasoning:
+            self.dropped_chars += len(text)
+            return
+        if self._skip_whitespace:
+            text = text.lstrip()
+            self._skip_whitespace = not text
+        visible.append(text)
+
+def filter_stream(stream, reasoning: ReasoningFilter):
+    """Pass Ollama chat chunks through `reasoning`, chunk contents are replaced with their visible part."""
+    for chunk in stream:
+        _filter_chunk(chunk, reasoning)
+        yield chunk
+
+async def afilter_stream(stream, reasoning: ReasoningFilter):
+    async for chunk in stream:
+        _filter_chunk(chunk, reasoning)
+        yield chunk
+
+def _filter_chunk(chunk, reasoning: ReasoningFilter) -> None:
+    content = reasoning.feed(chunk["message"]["content"])
+    if chunk.get("done"):
+        content += reasoning.flush()
+    chunk["message"]["content"] = content
@@ -0,0 +1,173 @@
+import os
+import json
+import hashlib
+import asyncio
+import threading
+from collections import OrderedDict
+
+# Cache of complete model replies, keyed on everything that decides the reply: model, messages (wrapped system
+# prompt, history and prompt) and sampling options. Requests that may be cached are sent with fixed options and
+# a fixed seed, so a cached reply is the reply the model would have given.
+CACHE_ENABLED = os.environ.get("TALKING_HEADS_CACHE", "0") == "1"
+CACHE_OPTIONS = {"seed": 42, "temperature": 0.8}
+CACHE_DIR = os.environ.get("TALKING_HEADS_CACHE_DIR", os.path.join(os.path.dirname(__file__), "cache"))
+MEMORY_LIMIT = 32 * 1024 * 1024 # bytes
+DISK_LIMIT = 512 * 1024 * 1024 # bytes
+
+def make_key(model: str, messages: list[dict], options: dict) -> str:
+    payload = json.dumps([model, messages, options], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+class ResponseCache:
+    """Two tiers with size based eviction: an in-memory LRU in front of a directory of json files.
+    An entry is the list of streamed chunk texts, so a hit can be replayed chunk by chunk. The a-methods are for
+    the background loop and do the file access in a worker thread."""
+
+    def __init__(self, directory=CACHE_DIR, memory_limit=MEMORY_LIMIT, disk_limit=DISK_LIMIT):
+        self.directory = directory
+        self.memory_limit = memory_limit
+        self.disk_limit = disk_limit
+        self.memory = OrderedDict() # { key: (chunks, size) }
+        self.memory_bytes = 0
+        self.disk_bytes = 0
+        self.counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0}
+        self._lock = threading.Lock() # memory tier and counters, never held during file access
+        self._disk_lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self.disk_bytes = sum(entry.stat().st_size for entry in os.scandir(directory) if entry.name.endswith(".json"))
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key: str) -> list[str] | None:
+        chunks = self._get_memory(key)
+        return chunks if chunks is not None else self._get_disk(key)
+
+    async def aget(self, key: str) -> list[str] | None:
+        """get for the background loop: only the memory tier is read on the loop, the disk in a worker thread."""
+        chunks = self._get_memory(key)
+        return chunks if chunks is not None else await asyncio.to_thread(self._get_disk, key)
+
+    def put(self, key: str, chunks: list[str]) -> None:
+        with self._lock:
+            self._remember(key, chunks)
+        self._put_disk(key, chunks)
+
+    async def aput(self, key: str, chunks: list[str]) -> None:
+        with self._lock:
+            self._remember(key, chunks)
+        await asyncio.to_thread(self._put_disk, key, chunks)
+
+    def _get_memory(self, key: str) -> list[str] | None:
+        with self._lock:
+            if key not in self.memory:
+                return None
+            self.memory.move_to_end(key)
+            self.counters["memory_hits"] += 1
+            return self.memory[key][0]
+
+    def _get_disk(self, key: str) -> list[str] | None:
+        path = self._path(key)
+        with self._disk_lock:
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    chunks = json.load(f)
+                os.utime(path) # disk eviction goes by last use
+            except (OSError, ValueError):
+                chunks = None
+        with self._lock:
+            if chunks is None:
+                self.counters["misses"] += 1
+                return None
+            self.counters["disk_hits"] += 1
+            self._remember(key, chunks)
+        return chunks
+
+    def _put_disk(self, key: str, chunks: list[str]) -> None:
+        data = json.dumps(chunks, ensure_ascii=False)
+        path = self._path(key)
+        with self._disk_lock:
+            if not os.path.exists(path):
+                with open(path, "w", encoding="utf-8") as f:
+                    f.write(data)
+                self.disk_bytes += os.path.getsize(path)
+                self._evict_disk()
+        with self._lock:
+            self.counters["stores"] += 1
+
+    def _remember(self, key: str, chunks: list[str]) -> None:
+        if key in self.memory:
+            return
+        size = sum(len(chunk) for chunk in chunks)
+        self.memory[key] = (chunks, size)
+        self.memory_bytes += size
+        while self.memory_bytes > self.memory_limit and len(self.memory) > 1:
+            _, (_, evicted_size) = self.memory.popitem(last=False)
+            self.memory_bytes -= evicted_size
+
+    def _evict_disk(self) -> None:
+        if self.disk_bytes <= self.disk_limit:
+            return
+        entries = sorted((entry for entry in os.scandir(self.directory) if entry.name.endswith(".json")), key=lambda entry: entry.stat().st_mtime)
+        for entry in entries:
+            if self.disk_bytes <= self.disk_limit:
+                break
+            size = entry.stat().st_size
+            os.remove(entry.path)
+            self.disk_bytes -= size
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self.counters, memory_entries=len(self.memory), memory_bytes=self.memory_bytes, disk_bytes=self.disk_bytes)
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_cache() -> ResponseCache:
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResponseCache()
+    return _cache
+
+def stats() -> dict:
+    return get_cache().stats()
+
+def _replayed_chunk(model: str, content: str, done: bool) -> dict:
+    # same shape as the chunks ollama streams, so callers can't tell a hit from a live reply
+    return {"model": model, "message": {"role": "assistant", "content": content}, "done": done, "done_reason": "stop" if done else None}
+
+def replay(model: str, chunks: list[str]):
+    for chunk in chunks:
+        yield _replayed_chunk(model, chunk, False)
+    yield _replayed_chunk(model, "", True)
+
+async def areplay(model: str, chunks: list[str]):
+    for chunk in replay(model, chunks):
+        yield chunk
+
+def record(key: str, stream):
+    """Pass a live stream through and store the reply once it completed."""
+    chunks = []
+    for chunk in stream:
+        chunks.append(chunk["message"]["content"])
+        yield chunk
+        if chunk["done"]:
+            get_cache().put(key, chunks)
+
+async def arecord(key: str, stream):
+    chunks = []
+    async for chunk in stream:
+        chunks.append(chunk["message"]["content"])
+        yield chunk
+        if chunk["done"]:
+            await get_cache().aput(key, chunks)
+
+async def acached(key: str, model: str, open_stream):
+    """Replay a cached reply, or open the live stream with open_stream() and record it. Nothing is read before
+    the first chunk is requested, and the disk tier is never read on the loop."""
+    cache = get_cache() if _cache is not None else await asyncio.to_thread(get_cache) # the first call scans the directory
+    chunks = await cache.aget(key)
+    stream = areplay(model, chunks) if chunks is not None else arecord(key, open_stream())
+    async for chunk in stream:
+        yield chunk
@@ -0,0 +1,138 @@
+import os
+import asyncio
+import contextlib
+from collections import OrderedDict, deque
+import background_loop
+
+# Process-wide admission control for the shared Ollama server. Every chat request waits for a slot here:
+# at most MAX_CONCURRENCY generations run at once, waiting sessions take turns round robin, and if enabled a
+# free slot prefers a request for the model that just ran, so Ollama doesn't swap models back and forth.
+MAX_CONCURRENCY = int(os.environ.get("TALKING_HEADS_MAX_CONCURRENCY", os.environ.get("OLLAMA_NUM_PARALLEL", 1)))
+GROUP_BY_MODEL = True
+MAX_MODEL_STREAK = 4 # grants in a row that may jump the round robin order to stay on the same model
+MAX_QUEUED_PER_SESSION = 4
+MAX_QUEUED = 64
+
+class SchedulerBusy(RuntimeError):
+    """Raised instead of queueing when the server already has too much waiting work."""
+
+class Ticket:
+    __slots__ = ("session_id", "model", "granted", "on_position", "position")
+
+    def __init__(self, session_id: str, model: str, on_position=None):
+        self.session_id = session_id
+        self.model = model
+        self.granted = asyncio.get_running_loop().create_future()
+        self.on_position = on_position
+        self.position = None
+
+class Scheduler:
+    """Fair queue in front of the Ollama server. Lives on the background loop."""
+
+    def __init__(self, max_concurrency=MAX_CONCURRENCY, group_by_model=GROUP_BY_MODEL):
+        self.max_concurrency = max_concurrency
+        self.group_by_model = group_by_model
+        self.queues = OrderedDict() # { session_id: deque of tickets }, in round robin order
+        self.running = 0
+        self.last_model = None
+        self.streak = 0
+
+    @property
+    def queued(self) -> int:
+        return sum(len(queue) for queue in self.queues.values())
+
+    async def acquire(self, session_id: str, model: str, on_position=None) -> Ticket:
+        queue = self.queues.get(session_id)
+        if self.queued >= MAX_QUEUED or (queue and len(queue) >= MAX_QUEUED_PER_SESSION):
+            raise SchedulerBusy("The model server is busy, try again in a moment.")
+        ticket = Ticket(session_id, model, on_position)
+        self.queues.setdefault(session_id, deque()).append(ticket)
+        self._dispatch()
+        try:
+            await ticket.granted
+        except asyncio.CancelledError:
+            if ticket.granted.done() and not ticket.granted.cancelled():
+                self.release(ticket)
+            else:
+                self._forget(ticket)
+            raise
+        return ticket
+
+    def release(self, ticket: Ticket) -> None:
+        self.running -= 1
+        self._dispatch()
+
+    @contextlib.asynccontextmanager
+    async def slot(self, session_id: str, model: str, on_position=None):
+        ticket = await self.acquire(session_id, model, on_position)
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    def _forget(self, ticket: Ticket) -> None:
+        queue = self.queues.get(ticket.session_id)
+        if queue and ticket in queue:
+            queue.remove(ticket)
+            if not queue:
+                del self.queues[ticket.session_id]
+        self._report_positions()
+
+    def _next_session(self) -> str:
+        if self.group_by_model and self.last_model and self.streak < MAX_MODEL_STREAK:
+            for session_id, queue in self.queues.items():
+                if queue[0].model == self.last_model:
+                    return session_id
+        return next(iter(self.queues))
+
+    def _dispatch(self) -> None:
+        while self.queues and self.running < self.max_concurrency:
+            session_id = self._next_session()
+            queue = self.queues.pop(session_id)
+            ticket = queue.popleft()
+            if queue:
+                # the session goes to the back of the round robin
+                self.queues[session_id] = queue
+            if ticket.granted.done():
+                continue # cancelled while waiting
+            self.streak = self.streak + 1 if ticket.model == self.last_model else 1
+            self.last_model = ticket.model
+            self.running += 1
+            ticket.granted.set_result(ticket)
+        self._report_positions()
+
+    def _report_positions(self) -> None:
+        for place, queue in enumerate(self.queues.values(), start=1):
+            for ticket in queue:
+                if ticket.on_position and ticket.position != place:
+                    ticket.position = place
+                    ticket.on_position(place)
+
+_scheduler = None
+
+def get_scheduler() -> Scheduler:
+    """The process-wide scheduler, must be used from the background loop."""
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = Scheduler()
+    return _scheduler
+
+async def scheduled_stream(session_id: str, model: str, open_stream, on_position=None, on_granted=None):
+    """Wait for a slot, then pass the async stream returned by open_stream() through. The slot is held until
+    the stream ends or is closed. on_granted() is called when the slot is granted, before the request is sent."""
+    async with get_scheduler().slot(session_id, model, on_position):
+        if on_granted:
+            on_granted()
+        async with contextlib.aclosing(open_stream()) as stream:
+            async for chunk in stream:
+                yield chunk
+
+def scheduled_stream_sync(session_id: str, model: str, open_stream):
+    """Same as scheduled_stream for blocking callers outside the background loop."""
+    scheduler = get_scheduler()
+    ticket = background_loop.run(scheduler.acquire(session_id, model))
+    try:
+        with contextlib.closing(open_stream()) as stream:
+            yield from stream
+    finally:
+        background_loop.get_loop().call_soon_threadsafe(scheduler.release, ticket)
@@ -0,0 +1,195 @@
+import os
+import json
+import time
+import threading
+import atexit
+from dataclasses import dataclass, field
+import response_cache
+
+# Per-turn performance numbers. The final chunk of every Ollama stream reports where the server spent its time
+# (durations in nanoseconds); the client adds time to first token, gaps between chunks and render time.
+METRICS_FILE = os.environ.get("TALKING_HEADS_METRICS_FILE", os.path.join(os.path.dirname(__file__), "logs", "metrics.json"))
+METRICS_INTERVAL = 10 # seconds between two writes of the metrics file
+SERVER_FIELDS = ("total_duration", "load_duration", "prompt_eval_count", "prompt_eval_duration", "eval_count", "eval_duration")
+
+@dataclass
+class TurnMetrics:
+    session_id: str
+    model: str
+    ttft: float = 0.0 # seconds from sending the request to the first chunk
+    duration: float = 0.0 # seconds from sending the request to the last chunk
+    chunks: int = 0
+    max_gap: float = 0.0 # longest wait between two chunks, seconds
+    cached: bool = False # replayed from the response cache, no server numbers
+    reasoning_tokens: int = 0 # streamed inside <think> blocks and dropped
+    server: dict = field(default_factory=dict)
+
+class TurnTimer:
+    """Collects the client side timings of one streamed turn."""
+
+    def __init__(self, session_id: str, model: str):
+        self.metrics = TurnMetrics(session_id, model)
+        self.started = time.monotonic()
+        self.last_chunk = None
+
+    def restart(self) -> None:
+        """Time from now on, once a request that waited for the server is sent."""
+        self.started = time.monotonic()
+
+    def chunk(self, chunk) -> None:
+        now = time.monotonic()
+        if self.last_chunk is None:
+            self.metrics.ttft = now - self.started
+        else:
+            self.metrics.max_gap = max(self.metrics.max_gap, now - self.last_chunk)
+        self.last_chunk = now
+        self.metrics.chunks += 1
+        if chunk.get("done"):
+            self.metrics.server = { name: chunk.get(name) or 0 for name in SERVER_FIELDS }
+            self.metrics.cached = not self.metrics.server["eval_count"]
+
+    def finish(self, reasoning_tokens=0) -> TurnMetrics:
+        self.metrics.duration = time.monotonic() - self.started
+        self.metrics.reasoning_tokens = reasoning_tokens
+        record_turn(self.metrics)
+        return self.metrics
+
+class Aggregate:
+    """Running totals for a group of turns."""
+
+    def __init__(self):
+        self.turns = 0
+        self.cached_turns = 0
+        self.chunks = 0
+        self.reasoning_tokens = 0
+        self.ttft = 0.0
+        self.duration = 0.0
+        self.max_gap = 0.0
+        self.render_time = 0.0
+        self.renders = 0
+        self.reclaimed_time = 0.0 # estimated generation time saved by cancelled conversations
+        self.server = dict.fromkeys(SERVER_FIELDS, 0)
+
+    def add_turn(self, turn: TurnMetrics) -> None:
+        self.turns += 1
+        self.cached_turns += turn.cached
+        self.chunks += turn.chunks
+        self.reasoning_tokens += turn.reasoning_tokens
+        self.ttft += turn.ttft
+        self.duration += turn.duration
+        self.max_gap = max(self.max_gap, turn.max_gap)
+        for name in SERVER_FIELDS:
+            self.server[name] += turn.server.get(name, 0)
+
+    def add_render(self, seconds: float) -> None:
+        self.render_time += seconds
+        self.renders += 1
+
+    def summary(self) -> dict:
+        server = self.server
+        return {
+            "turns": self.turns,
+            "cached_turns": self.cached_turns,
+            "tokens_per_second": round(server["eval_count"] / (server["eval_duration"] / 1e9), 1) if server["eval_duration"] else None,
+            "avg_ttft": round(self.ttft / self.turns, 3) if self.turns else None,
+            "prompt_eval_share": round(server["prompt_eval_duration"] / server["total_duration"], 3) if server["total_duration"] else None,
+            "load_time": round(server["load_duration"] / 1e9, 2),
+            "avg_turn_time": round(self.duration / self.turns, 2) if self.turns else None,
+            "max_gap": round(self.max_gap, 3),
+            "avg_render_time": round(self.render_time / self.renders, 4) if self.renders else None,
+            "reclaimed_time": round(self.reclaimed_time, 1),
+            "prompt_tokens": server["prompt_eval_count"],
+            "generated_tokens": server["eval_count"],
+            "reasoning_tokens": self.reasoning_tokens,
+        }
+
+_lock = threading.Lock()
+_by_model = {} # { "model_name": Aggregate }
+_by_session = {} # { "session_id": Aggregate }
+_by_session_model = {} # { ("session_id", "model_name"): Aggregate }
+_counters = {"turns": 0, "generated_tokens": 0, "prompt_tokens": 0, "server_seconds": 0.0, "reasoning_tokens": 0, "cancelled_conversations": 0, "reclaimed_seconds": 0.0,
+             "cancellations_without_estimate": 0}
+_last_write = 0.0
+_write_lock = threading.Lock() # one writer at a time for the shared temporary file
+
+def record_turn(turn: TurnMetrics) -> None:
+    with _lock:
+        for group, key in ((_by_model, turn.model), (_by_session, turn.session_id), (_by_session_model, (turn.session_id, turn.model))):
+            group.setdefault(key, Aggregate()).add_turn(turn)
+        _counters["turns"] += 1
+        _counters["generated_tokens"] += turn.server.get("eval_count", 0)
+        _counters["prompt_tokens"] += turn.server.get("prompt_eval_count", 0)
+        _counters["reasoning_tokens"] += turn.reasoning_tokens
+        _counters["server_seconds"] += turn.server.get("total_duration", 0) / 1e9
+    _write_in_background()
+
+def record_cancellation(session_id: str, reclaimed_seconds: float | None) -> None:
+    """A conversation stopped early, `reclaimed_seconds` is the estimated generation time nobody has to wait for,
+    None if it couldn't be estimated."""
+    with _lock:
+        _counters["cancelled_conversations"] += 1
+        if reclaimed_seconds is None:
+            _counters["cancellations_without_estimate"] += 1
+        else:
+            _counters["reclaimed_seconds"] += reclaimed_seconds
+            _by_session.setdefault(session_id, Aggregate()).reclaimed_time += reclaimed_seconds
+    _write_in_background()
+
+def record_render(session_id: str, seconds: float) -> None:
+    with _lock:
+        _by_session.setdefault(session_id, Aggregate()).add_render(seconds)
+
+def average_turn_time(model: str) -> float | None:
+    with _lock:
+        aggregate = _by_model.get(model)
+        return aggregate.duration / aggregate.turns if aggregate and aggregate.turns else None
+
+def session_summary(session_id: str) -> dict:
+    with _lock:
+        aggregate = _by_session.get(session_id)
+        return aggregate.summary() if aggregate else {}
+
+def session_model_summaries(session_id: str) -> dict[str, dict]:
+    with _lock:
+        return { model: aggregate.summary() for (session, model), aggregate in _by_session_model.items() if session == session_id }
+
+def snapshot() -> dict:
+    """Process-wide counters and per model aggregates."""
+    with _lock:
+        data = {
+            "time": time.time(),
+            "counters": dict(_counters),
+            "sessions": len(_by_session),
+            "models": { model: aggregate.summary() for model, aggregate in _by_model.items() },
+        }
+    if response_cache.CACHE_ENABLED:
+        data["cache"] = response_cache.stats()
+    return data
+
+def _write_due() -> bool:
+    global _last_write
+    with _lock:
+        now = time.monotonic()
+        if now - _last_write < METRICS_INTERVAL:
+            return False
+        _last_write = now
+        return True
+
+def _write_in_background() -> None:
+    # turns are recorded on the background loop, which must not wait for the disk
+    if _write_due():
+        threading.Thread(target=write_metrics_file, args=(True,), name="metrics-writer", daemon=True).start()
+
+def write_metrics_file(force=False) -> None:
+    """Write the snapshot as json, at most once per METRICS_INTERVAL unless forced. Blocks on file I/O."""
+    if not force and not _write_due():
+        return
+    data = snapshot()
+    with _write_lock:
+        os.makedirs(os.path.dirname(METRICS_FILE), exist_ok=True)
+        temporary_path = METRICS_FILE + ".tmp"
+        with open(temporary_path, "w") as f:
+            json.dump(data, f, indent=2)
+        os.replace(temporary_path, METRICS_FILE) # readers never see a half written file
+
+atexit.register(write_metrics_file, True)
@@ -0,0 +1,22 @@
+import os
+import sys
+import pytest
+from fake_ollama import FakeOllama, FakeSettings
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# The app's modules read OLLAMA_HOST when they are imported, so the fake server starts before any test module loads.
+_fake = FakeOllama().start()
+os.environ["OLLAMA_HOST"] = _fake.url
+
+@pytest.fixture(scope="session")
+def fake_ollama() -> FakeOllama:
+    return _fake
+
+@pytest.fixture
+def fake(fake_ollama) -> FakeOllama:
+    """The shared fake server, with default settings for every test."""
+    fake_ollama.settings = FakeSettings()
+    yield fake_ollama
+    fake_ollama.settings = FakeSettings()
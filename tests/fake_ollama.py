@@ -0,0 +1,160 @@
+"""Local stand-in for the Ollama HTTP API, for tests and benchmarks on machines without models or a GPU.
+
+Serves /api/tags, /api/show, /api/chat (streaming and not) and /api/generate (model loading) with a configurable
+time to first token, token rate, reply length and error injection. Settings can be changed while it runs.
+"""
+import json
+import time
+import random
+import threading
+from dataclasses import dataclass, field
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+DEFAULT_MODELS = ["phi3:3.8b", "llama3.2:3b", "qwen2.5:1.5b", "dolphin3:8b"]
+
+@dataclass
+class FakeSettings:
+    models: list = field(default_factory=lambda: list(DEFAULT_MODELS))
+    ttft: float = 0.02 # seconds before the first token
+    tokens_per_second: float = 500.0
+    response_tokens: int = 20
+    reasoning_tokens: int = 0 # tokens of a <think> block streamed before the reply
+    context_length: int = 4096
+    error_rate: float = 0.0 # share of chat requests answered with a server error
+    disconnect_rate: float = 0.0 # share of streamed chat requests cut off halfway
+    load_seconds: float = 0.0 # time /api/generate takes to load a model
+    seed: int = 0
+
+class FakeOllama:
+    """Runs the fake server on a free port in a daemon thread. Use as a context manager or call start()/stop()."""
+
+    def __init__(self, settings: FakeSettings | None = None, port=0):
+        self.settings = settings or FakeSettings()
+        self.requests = {} # { "/api/...": count }
+        self.arrivals = [] # (path, time.monotonic()) of every request
+        self.abandoned = 0 # streams the client closed before they ended
+        self._random = random.Random(self.settings.seed)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), _handler_for(self))
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FakeOllama":
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-ollama", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "FakeOllama":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    def _count(self, path: str) -> None:
+        with self._lock:
+            self.requests[path] = self.requests.get(path, 0) + 1
+            self.arrivals.append((path, time.monotonic()))
+
+    def _roll(self, rate: float) -> bool:
+        with self._lock:
+            return rate > 0 and self._random.random() < rate
+
+def _token(index: int) -> str:
+    return f"word{index % 50} "
+
+def _handler_for(fake: FakeOllama):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            fake._count(self.path)
+            if self.path == "/api/tags":
+                models = [{"name": name, "model": name, "size": 2 * 1024 ** 3, "digest": f"sha256:{abs(hash(name)):x}",
+                           "details": {"parameter_size": "3B", "quantization_level": "Q4_0"}} for name in fake.settings.models]
+                return self._json({"models": models})
+            self._json({"error": "not found"}, status=404)
+
+        def do_POST(self):
+            fake._count(self.path)
+            length = int(self.headers.get("Content-Length") or 0)
+            body = json.loads(self.rfile.read(length) or b"{}")
+            if self.path == "/api/show":
+                return self._json({"details": {"parameter_size": "3B", "quantization_level": "Q4_0"},
+                                   "model_info": {"llama.context_length": fake.settings.context_length}})
+            if self.path == "/api/generate":
+                time.sleep(fake.settings.load_seconds)
+                return self._json({"model": body.get("model"), "created_at": "2025-01-01T00:00:00Z", "response": "", "done": True})
+            if self.path == "/api/chat":
+                if fake._roll(fake.settings.error_rate):
+                    return self._json({"error": "injected failure"}, status=500)
+                return self._chat(body)
+            self._json({"error": "not found"}, status=404)
+
+        def _chat(self, body: dict):
+            settings = fake.settings
+            prompt_tokens = sum(len(message.get("content", "")) for message in body.get("messages", [])) // 4
+            pieces = []
+            if settings.reasoning_tokens:
+                pieces = ["<think>"] + [_token(i) for i in range(settings.reasoning_tokens)] + ["</think>\n\n"]
+            pieces += [_token(i) for i in range(settings.response_tokens)]
+            eval_seconds = len(pieces) / settings.tokens_per_second
+            final = {
+                "total_duration": int((settings.ttft + eval_seconds) * 1e9),
+                "load_duration": 0,
+                "prompt_eval_count": prompt_tokens,
+                "prompt_eval_duration": int(settings.ttft * 1e9),
+                "eval_count": len(pieces),
+                "eval_duration": int(eval_seconds * 1e9),
+                "done_reason": "stop",
+            }
+            time.sleep(settings.ttft)
+            if not body.get("stream", True):
+                message = {"role": "assistant", "content": "".join(pieces)}
+                return self._json(dict(final, model=body["model"], created_at="2025-01-01T00:00:00Z", message=message, done=True))
+
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            cut_at = len(pieces) // 2 if fake._roll(settings.disconnect_rate) else None
+            try:
+                for index, piece in enumerate(pieces):
+                    if index == cut_at:
+                        self.close_connection = True
+                        return # no terminating chunk, the client sees a broken stream
+                    self._chunk({"model": body["model"], "created_at": "2025-01-01T00:00:00Z",
+                                 "message": {"role": "assistant", "content": piece}, "done": False})
+                    time.sleep(1 / settings.tokens_per_second)
+                self._chunk(dict(final, model=body["model"], created_at="2025-01-01T00:00:00Z",
+                                 message={"role": "assistant", "content": ""}, done=True))
+                self.wfile.write(b"0\r\n\r\n")
+            except (BrokenPipeError, ConnectionResetError):
+                with fake._lock:
+                    fake.abandoned += 1 # the client closed the stream
+
+        def _chunk(self, data: dict):
+            line = (json.dumps(data) + "\n").encode("utf-8")
+            self.wfile.write(b"%x\r\n" % len(line) + line + b"\r\n")
+            self.wfile.flush()
+
+        def _json(self, data: dict, status=200):
+            payload = json.dumps(data).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+    return Handler
@@ -1,3 +1,51 @@
 """Testing using pytest"""
 from streamlit.testing.v1 import AppTest
+import ollama_tools
+from conversation_engine import ConversationEngine
 
+def test_page_loads(fake):
+    at = AppTest.from_file("../app.py", default_timeout=60)
+    at.run()
+    assert not at.exception
+    assert at.session_state.model_data["all_models"]
+
+def finished_conversation(session_id: str) -> ConversationEngine:
+    engine = ConversationEngine(
+        models={ "left": "phi3:3.8b", "right": "llama3.2:3b" },
+        aliases={ "left": "Phi", "right": "Llama" },
+        system_prompts={ "left": ollama_tools.DEFAULT_SYSTEM_PROMPT_LEFT, "right": ollama_tools.DEFAULT_SYSTEM_PROMPT_RIGHT },
+        first_side="left",
+        initial_prompt="Coffee or tea?",
+        max_turns=4,
+        session_id=session_id,
+    ).start()
+    for _ in engine.iter_events():
+        pass
+    return engine
+
+def test_a_delivered_conversation_keeps_one_event_per_turn(fake):
+    engine = finished_conversation("page-compact")
+    full_log = engine.log
+    delivered = { "conversation": engine.transcript_id, "sent": engine.event_count }
+    at = AppTest.from_file("../app.py", default_timeout=60)
+    at.session_state["engine"] = engine
+    at.session_state["transcript_state"] = delivered
+    at.run()
+    assert not at.exception
+    kinds = [event.kind for event in engine.events_since(0)]
+    assert kinds == ["turn_start", "token", "turn_end"] * 4 + ["done"]
+    assert [event.content for event in engine.events_since(0) if event.kind == "token"] == [turn.content for turn in engine.turns]
+    assert engine.transcript_id != delivered["conversation"] # the browser gets the compacted events from the start
+    assert len(list(full_log.iter())) > engine.event_count # whoever still follows the old log keeps it
+
+def test_a_running_conversation_is_not_compacted(fake):
+    fake.settings.tokens_per_second = 20 # a second per reply
+    engine = ConversationEngine({ "left": "phi3:3.8b", "right": "llama3.2:3b" }, { "left": "Phi", "right": "Llama" },
+                                { "left": "a", "right": "b" }, "left", "Coffee?", 2, session_id="page-running").start()
+    for event in engine.iter_events():
+        if event.kind == "token":
+            break
+    transcript_id = engine.transcript_id
+    engine.compact_events()
+    assert engine.transcript_id == transcript_id
+    engine.cancel()
@@ -0,0 +1,207 @@
+"""Benchmarks of the app's own overhead, against the fake Ollama server so model speed doesn't count.
+
+Timings depend on the machine and its load, so the benchmarks only run when asked for:
+
+    TALKING_HEADS_BENCH=1 python -m pytest tests/test_benchmarks.py
+
+Every benchmark compares its number with tests/benchmark_baseline.json and fails when it got slower or bigger than
+REGRESSION_FACTOR times the baseline. Results are also written to logs/benchmarks.json. After an intended change,
+refresh the baseline with:
+
+    TALKING_HEADS_UPDATE_BASELINE=1 python -m pytest tests/test_benchmarks.py
+
+The checks that injected failures end a conversation cleanly always run.
+"""
+import os
+import sys
+import json
+import time
+import statistics
+import pytest
+from streamlit.testing.v1 import AppTest
+import background_loop
+import ollama_tools
+import scheduler
+from conversation_engine import ConversationEngine
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_FILE = os.path.join(os.path.dirname(__file__), "benchmark_baseline.json")
+RESULTS_FILE = os.path.join(ROOT, "logs", "benchmarks.json")
+UPDATE_BASELINE = os.environ.get("TALKING_HEADS_UPDATE_BASELINE") == "1"
+RUN_BENCHMARKS = UPDATE_BASELINE or os.environ.get("TALKING_HEADS_BENCH") == "1"
+REGRESSION_FACTOR = float(os.environ.get("TALKING_HEADS_BENCH_FACTOR", 1.5)) # raise on slow or busy machines
+# noise allowance on top of the factor, per unit; a busy CPU easily adds tens of milliseconds to a sub-millisecond number
+ABSOLUTE_SLACK = { "ms": 25.0, "bytes": 0, "ratio": 0.1 }
+TURNS = 6
+CONCURRENT_SESSIONS = [1, 2, 4, 8]
+# objects followed when measuring session_state, everything else (loops, locks, modules) is shared or not ours
+MEASURED_MODULES = {"conversation_engine", "context_window", "telemetry", "reasoning_filter", "fan_out", "turn_log"}
+
+_results = {}
+
+benchmark = pytest.mark.skipif(not RUN_BENCHMARKS, reason="benchmarks run with TALKING_HEADS_BENCH=1")
+
+def _load_baseline() -> dict:
+    try:
+        with open(BASELINE_FILE, "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+def check(name: str, value: float, unit: str) -> None:
+    """Record a result and fail if it regressed against the baseline."""
+    _results[name] = { "value": round(value, 3), "unit": unit }
+    if UPDATE_BASELINE:
+        return
+    baseline = _load_baseline().get(name)
+    if baseline is None:
+        pytest.skip(f"no baseline for {name}, run with TALKING_HEADS_UPDATE_BASELINE=1")
+    limit = baseline["value"] * REGRESSION_FACTOR + ABSOLUTE_SLACK[unit]
+    assert value <= limit, f"{name} regressed: {value:.3f} {unit}, baseline {baseline['value']} {unit} (limit {limit:.3f})"
+
+@pytest.fixture(scope="module", autouse=True)
+def report():
+    yield
+    if not _results:
+        return
+    os.makedirs(os.path.dirname(RESULTS_FILE), exist_ok=True)
+    with open(RESULTS_FILE, "w") as f:
+        json.dump(_results, f, indent=2)
+    if UPDATE_BASELINE:
+        with open(BASELINE_FILE, "w") as f:
+            json.dump(_results, f, indent=2, sort_keys=True)
+            f.write("\n")
+    sys.stdout.write("\n" + "\n".join(f"{name:40} {result['value']:>12} {result['unit']}" for name, result in _results.items()) + "\n")
+
+def model_seconds(settings, tokens=None) -> float:
+    """Time the fake server itself takes for one reply."""
+    return settings.ttft + (tokens or settings.response_tokens) / settings.tokens_per_second
+
+def run_conversation(session_id: str, turns=TURNS, use_context=True) -> ConversationEngine:
+    engine = ConversationEngine(
+        models={ "left": "phi3:3.8b", "right": "llama3.2:3b" },
+        aliases={ "left": "Phi", "right": "Llama" },
+        system_prompts={ "left": ollama_tools.DEFAULT_SYSTEM_PROMPT_LEFT, "right": ollama_tools.DEFAULT_SYSTEM_PROMPT_RIGHT },
+        first_side="left",
+        initial_prompt="Coffee or tea?",
+        max_turns=turns,
+        use_context=use_context,
+        session_id=session_id,
+    )
+    return engine.start()
+
+def wait_for(engines: list[ConversationEngine]) -> None:
+    for engine in engines:
+        for _ in engine.iter_events():
+            pass
+
+def set_parallel(parallel: int) -> None:
+    async def resize():
+        scheduler.get_scheduler().max_concurrency = parallel
+    background_loop.run(resize())
+
+def deep_size(obj, seen=None) -> int:
+    seen = set() if seen is None else seen
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_size(key, seen) + deep_size(value, seen) for key, value in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(deep_size(item, seen) for item in obj)
+    elif type(obj).__module__ in MEASURED_MODULES:
+        if hasattr(obj, "__dict__"):
+            size += deep_size(vars(obj), seen)
+        for slot in getattr(type(obj), "__slots__", ()):
+            size += deep_size(getattr(obj, slot, None), seen)
+    return size
+
+def app_test(**state) -> AppTest:
+    at = AppTest.from_file(os.path.join(ROOT, "app.py"), default_timeout=60)
+    for key, value in state.items():
+        at.session_state[key] = value
+    return at
+
+def timed_app_run(**state) -> tuple[float, AppTest]:
+    # one run per AppTest: widget values can't be changed between runs (pills raise on a rerun after a value was set)
+    at = app_test(**state)
+    started = time.perf_counter()
+    at.run()
+    elapsed = time.perf_counter() - started
+    assert not at.exception, at.exception
+    return elapsed, at
+
+@benchmark
+def test_request_overhead(fake):
+    """Time ollama_tools adds to a streamed reply: scheduling, the client and chunk handling."""
+    overheads = []
+    for _ in range(5):
+        started = time.perf_counter()
+        for _ in ollama_tools.get_llm_response_streaming("phi3:3.8b", "You like coffee.", "Coffee?", [], session_id="bench-request"):
+            pass
+        overheads.append(time.perf_counter() - started - model_seconds(fake.settings))
+    check("request_overhead", statistics.median(overheads) * 1000, "ms")
+
+@benchmark
+def test_conversation_latency(fake):
+    """End-to-end conversation time beyond what the models take, per turn."""
+    engine = run_conversation("bench-latency")
+    wait_for([engine])
+    assert not engine.error
+    overhead = engine.finished_at - engine.started - TURNS * model_seconds(fake.settings)
+    check("conversation_overhead_per_turn", overhead / TURNS * 1000, "ms")
+
+@benchmark
+def test_render_overhead(fake):
+    """Page run time a finished conversation adds, per turn it shows."""
+    engine = run_conversation("bench-render")
+    wait_for([engine])
+    timed_app_run() # imports and caches, not measured
+    empty = statistics.median(timed_app_run()[0] for _ in range(3))
+    with_transcript = statistics.median(timed_app_run(engine=engine, transcript_state={})[0] for _ in range(3))
+    check("render_overhead_per_turn", max(0.0, with_transcript - empty) / TURNS * 1000, "ms")
+
+@benchmark
+def test_session_state_memory(fake):
+    """Memory one session holds after a conversation, engine and history included."""
+    engine = run_conversation("bench-memory")
+    wait_for([engine])
+    history = engine.history
+    # the browser already has every event, as it does once a conversation has been shown to the end
+    _, at = timed_app_run(engine=engine, conversation_log=history, transcript_state={ "conversation": engine.transcript_id, "sent": engine.event_count })
+    # the reply text is kept once in the history and once per turn in the events, not once per token
+    assert engine.event_count <= 3 * TURNS + 1
+    check("session_state_bytes", deep_size(at.session_state.filtered_state), "bytes")
+
+@benchmark
+def test_concurrent_sessions(fake):
+    """Slowdown of a conversation when several sessions run at once and the server has a slot for each."""
+    set_parallel(max(CONCURRENT_SESSIONS))
+    try:
+        timings = {}
+        for sessions in CONCURRENT_SESSIONS:
+            started = time.perf_counter()
+            engines = [run_conversation(f"bench-concurrent-{sessions}-{index}", turns=4) for index in range(sessions)]
+            wait_for(engines)
+            assert not any(engine.error for engine in engines)
+            timings[sessions] = time.perf_counter() - started
+        for sessions, seconds in timings.items():
+            _results[f"concurrent_{sessions}_sessions_seconds"] = { "value": round(seconds, 3), "unit": "s" }
+    finally:
+        set_parallel(scheduler.MAX_CONCURRENCY)
+    check("concurrency_slowdown", timings[max(CONCURRENT_SESSIONS)] / timings[1], "ratio")
+
+def test_injected_errors_end_the_conversation(fake):
+    fake.settings.error_rate = 1.0
+    engine = run_conversation("bench-errors", turns=2)
+    wait_for([engine])
+    assert engine.error
+    assert engine.log.events[-1].kind == "error"
+
+def test_broken_stream_ends_the_conversation(fake):
+    fake.settings.disconnect_rate = 1.0
+    engine = run_conversation("bench-disconnect", turns=2)
+    wait_for([engine])
+    assert engine.error
+    assert not engine.turns
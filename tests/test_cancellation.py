@@ -0,0 +1,101 @@
+import time
+import pytest
+import background_loop
+import ollama_tools
+import scheduler
+import telemetry
+import conversation_engine
+from conversation_engine import ConversationEngine
+
+def conversation(session_id: str, turns=4, is_alive=None) -> ConversationEngine:
+    return ConversationEngine(
+        models={ "left": "phi3:3.8b", "right": "llama3.2:3b" },
+        aliases={ "left": "Phi", "right": "Llama" },
+        system_prompts={ "left": ollama_tools.DEFAULT_SYSTEM_PROMPT_LEFT, "right": ollama_tools.DEFAULT_SYSTEM_PROMPT_RIGHT },
+        first_side="left",
+        initial_prompt="Coffee or tea?",
+        max_turns=turns,
+        session_id=session_id,
+        is_alive=is_alive,
+    ).start()
+
+def wait_until(condition, timeout=5) -> bool:
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+@pytest.fixture
+def slow_replies(fake):
+    fake.settings.tokens_per_second = 20
+    fake.settings.response_tokens = 200 # ten seconds per reply
+    return fake
+
+@pytest.fixture
+def cancellations(monkeypatch):
+    recorded = []
+    monkeypatch.setattr(telemetry, "record_cancellation", lambda session_id, seconds: recorded.append((session_id, seconds)))
+    return recorded
+
+def running_generations() -> int:
+    async def running():
+        return scheduler.get_scheduler().running
+    return background_loop.run(running())
+
+def test_cancel_stops_the_stream_and_the_remaining_turns(slow_replies, cancellations):
+    abandoned = slow_replies.abandoned
+    engine = conversation("cancel-stream")
+    assert wait_until(lambda: any(event.kind == "token" for event in engine.events_since(0)))
+    started = time.monotonic()
+    engine.cancel("stopped")
+    assert time.monotonic() - started < 2
+    assert engine.finished and engine.error == "stopped" and not engine.turns
+    kinds = [event.kind for event in engine.events_since(0)]
+    assert kinds[-1] == "cancelled" and engine.events_since(0)[-1].content == "stopped"
+    assert kinds.count("turn_start") == 1 and "turn_end" not in kinds
+    assert running_generations() == 0
+    assert wait_until(lambda: slow_replies.abandoned > abandoned) # the server noticed the closed stream
+    assert [session_id for session_id, _ in cancellations] == ["cancel-stream"]
+
+def test_reclaimed_time_is_estimated_from_finished_turns(fake, cancellations):
+    fake.settings.tokens_per_second = 50 # 0.4 seconds per reply
+    engine = conversation("cancel-estimate", turns=6)
+    assert wait_until(lambda: len(engine.turns) == 2)
+    engine.cancel()
+    (_, seconds), = cancellations
+    assert seconds is not None and seconds > 0
+
+def test_without_finished_turns_the_time_is_not_estimated(slow_replies, cancellations, monkeypatch):
+    monkeypatch.setattr(telemetry, "average_turn_time", lambda model: None) # a fresh process
+    engine = conversation("cancel-fresh")
+    assert wait_until(lambda: any(event.kind == "token" for event in engine.events_since(0)))
+    engine.cancel()
+    assert cancellations == [("cancel-fresh", None)]
+
+def test_cancellations_without_estimate_are_counted():
+    counters = telemetry.snapshot()["counters"]
+    telemetry.record_cancellation("cancel-count", None)
+    after = telemetry.snapshot()["counters"]
+    assert after["cancelled_conversations"] == counters["cancelled_conversations"] + 1
+    assert after["cancellations_without_estimate"] == counters["cancellations_without_estimate"] + 1
+    assert after["reclaimed_seconds"] == counters["reclaimed_seconds"]
+
+def test_a_conversation_nobody_watches_is_cancelled_after_the_grace_period(slow_replies, cancellations, monkeypatch):
+    monkeypatch.setattr(conversation_engine, "LIVENESS_INTERVAL", 0.02)
+    monkeypatch.setattr(conversation_engine, "DISCONNECT_GRACE", 0.2)
+    started = time.monotonic()
+    engine = conversation("cancel-gone", is_alive=lambda: False)
+    assert wait_until(lambda: engine.finished)
+    assert 0.2 <= time.monotonic() - started < 2
+    assert engine.cancel_reason == "disconnected"
+    assert engine.events_since(0)[-1].kind == "cancelled"
+    assert running_generations() == 0
+    assert cancellations[0][0] == "cancel-gone"
+
+def test_a_watched_conversation_keeps_running(fake, monkeypatch):
+    monkeypatch.setattr(conversation_engine, "LIVENESS_INTERVAL", 0.02)
+    monkeypatch.setattr(conversation_engine, "DISCONNECT_GRACE", 0.05)
+    fake.settings.tokens_per_second = 100 # 0.2 seconds per reply, several grace periods
+    engine = conversation("cancel-watched", turns=2, is_alive=lambda: True)
+    assert wait_until(lambda: engine.finished)
+    assert not engine.error and len(engine.turns) == 2
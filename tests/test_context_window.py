@@ -0,0 +1,79 @@
+import asyncio
+import pytest
+import ollama_tools
+import context_window
+from context_window import ContextWindow, message_tokens
+
+def conversation(pairs: int, reply_chars=360) -> list[dict]:
+    history = []
+    for index in range(pairs):
+        history.append({"role": "user", "content": f"question {index} " + "q" * 40})
+        history.append({"role": "assistant", "content": f"answer {index} " + "a" * reply_chars})
+    return history
+
+@pytest.fixture
+def summaries(monkeypatch):
+    calls = []
+    async def summarize(model, summary, messages, session_id=ollama_tools.DEFAULT_SESSION):
+        calls.append(list(messages))
+        return (summary + " " if summary else "") + f"{len(messages)} messages"
+    monkeypatch.setattr(ollama_tools, "summarize_history_async", summarize)
+    return calls
+
+def fit(window: ContextWindow, history: list[dict], reserved_tokens=50) -> None:
+    asyncio.run(window.fit(history, reserved_tokens))
+
+def test_history_within_budget_is_sent_as_is(summaries):
+    window = ContextWindow("phi3:3.8b", budget=2048)
+    history = conversation(4)
+    fit(window, history)
+    assert window.view(history) == history
+    assert not summaries
+
+def test_oldest_pairs_are_folded_down_to_the_low_watermark(summaries):
+    window = ContextWindow("phi3:3.8b", budget=1000)
+    history = conversation(12)
+    fit(window, history)
+    assert window.summarized % 2 == 0 and window.summarized > 0
+    assert summaries == [history[:window.summarized]]
+    assert window.view_tokens(history) + 50 <= 1000 * context_window.LOW_WATERMARK + 50 # the summary itself may add a little
+    assert window.view(history)[0]["role"] == "system"
+    assert window.view(history)[1:] == history[window.summarized:]
+
+def test_folding_extends_the_summary(summaries):
+    window = ContextWindow("phi3:3.8b", budget=1000)
+    history = conversation(12)
+    fit(window, history)
+    first = window.summarized
+    history += conversation(8)
+    fit(window, history)
+    assert window.summarized > first
+    assert summaries[1] == history[first:window.summarized]
+    assert window.summary.startswith(f"{first} messages ")
+
+def test_recent_messages_are_folded_only_to_stay_within_budget(summaries):
+    window = ContextWindow("phi3:3.8b", budget=600)
+    history = conversation(context_window.RECENT_MESSAGES // 2 + 1, reply_chars=720)
+    assert sum(message_tokens(message) for message in history[-context_window.RECENT_MESSAGES:]) > 600
+    fit(window, history)
+    assert window.view_tokens(history) + 50 <= 600
+    assert window.summarized <= len(history) - 2
+
+def test_the_latest_pair_is_always_kept(summaries):
+    window = ContextWindow("phi3:3.8b", budget=100)
+    history = conversation(4)
+    fit(window, history)
+    assert window.summarized == len(history) - 2
+    assert window.view(history)[1:] == history[-2:]
+
+def test_failed_summary_drops_the_folded_messages(monkeypatch, capsys):
+    async def summarize(*args, **kwargs):
+        raise ConnectionError("server gone")
+    monkeypatch.setattr(ollama_tools, "summarize_history_async", summarize)
+    window = ContextWindow("phi3:3.8b", budget=1000)
+    history = conversation(12)
+    fit(window, history)
+    assert window.summarized > 0
+    assert window.summary == ""
+    assert window.view(history) == history[window.summarized:]
+    assert "server gone" in capsys.readouterr().out
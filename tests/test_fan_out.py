@@ -0,0 +1,65 @@
+import time
+from streamlit.testing.v1 import AppTest
+import ollama_tools
+import model_catalog
+import scheduler
+import conversation_engine
+from fan_out import FanOut
+from conversation_engine import ConversationEngine
+
+def wait_until_finished(fan: FanOut, timeout=30) -> None:
+    deadline = time.monotonic() + timeout
+    while not fan.finished and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert fan.finished
+
+def test_more_models_than_a_session_may_queue(fake):
+    models = { f"Model {index}": "phi3:3.8b" for index in range(scheduler.MAX_QUEUED_PER_SESSION * 2) }
+    fan = FanOut(models, "You like coffee.", "Coffee or tea?", "fan-out-test").start()
+    wait_until_finished(fan)
+    assert [reply.status for reply in fan.replies] == ["done"] * len(models)
+
+def test_a_conversation_in_the_same_session_does_not_make_fan_out_busy(fake):
+    engine = ConversationEngine(
+        models={ "left": "phi3:3.8b", "right": "llama3.2:3b" },
+        aliases={ "left": "Phi", "right": "Llama" },
+        system_prompts={ "left": ollama_tools.DEFAULT_SYSTEM_PROMPT_LEFT, "right": ollama_tools.DEFAULT_SYSTEM_PROMPT_RIGHT },
+        first_side="left",
+        initial_prompt="Coffee or tea?",
+        max_turns=4,
+        session_id="fan-out-shared",
+    ).start()
+    models = { f"Model {index}": "llama3.2:3b" for index in range(scheduler.MAX_QUEUED_PER_SESSION) }
+    fan = FanOut(models, "You like coffee.", "Coffee or tea?", "fan-out-shared").start()
+    wait_until_finished(fan)
+    for _ in engine.iter_events():
+        pass
+    assert not engine.error
+    assert [reply.status for reply in fan.replies] == ["done"] * len(models), [reply.error for reply in fan.replies]
+
+def test_the_page_shows_the_server_limit(fake):
+    at = AppTest.from_file("../app.py", default_timeout=60)
+    at.session_state["fan_out_mode"] = True
+    at.session_state["fan_out_aliases"] = list(model_catalog.get_catalog().aliases())[:scheduler.get_scheduler().max_concurrency + 1]
+    at.run()
+    assert not at.exception
+    assert any("at a time" in caption.value for caption in at.caption)
+
+def test_time_to_first_token_excludes_the_wait_for_the_server(fake):
+    fake.settings.ttft = 0.05
+    fake.settings.tokens_per_second = 50 # 0.4 seconds per reply, one at a time
+    fan = FanOut({ f"Model {index}": "phi3:3.8b" for index in range(3) }, "You like coffee.", "Coffee or tea?", "fan-out-ttft").start()
+    wait_until_finished(fan)
+    if scheduler.get_scheduler().max_concurrency == 1:
+        assert sorted(reply.queue_wait for reply in fan.replies)[-1] > 0.5
+    assert all(reply.metrics.ttft < 0.25 for reply in fan.replies), [reply.metrics.ttft for reply in fan.replies]
+
+def test_fan_out_nobody_watches_is_cancelled(fake, monkeypatch):
+    monkeypatch.setattr(conversation_engine, "LIVENESS_INTERVAL", 0.02)
+    monkeypatch.setattr(conversation_engine, "DISCONNECT_GRACE", 0.2)
+    fake.settings.tokens_per_second = 10 # two seconds per reply
+    fan = FanOut({ "Phi": "phi3:3.8b", "Llama": "llama3.2:3b" }, "You like coffee.", "Coffee or tea?", "fan-out-gone",
+                 is_alive=lambda: False).start()
+    wait_until_finished(fan, timeout=1.5)
+    assert fan.disconnected
+    assert [reply.status for reply in fan.replies] == ["cancelled", "cancelled"]
@@ -0,0 +1,12 @@
+from fake_ollama import DEFAULT_MODELS
+from model_catalog import ModelCatalog
+
+def test_models_are_shown_once_per_version(fake):
+    catalog = ModelCatalog()
+    shown = fake.requests.get("/api/show", 0)
+    catalog.refresh()
+    assert fake.requests["/api/show"] == shown + len(DEFAULT_MODELS)
+    assert all(info.context_length == fake.settings.context_length for info in catalog.models.values())
+    catalog.refresh()
+    assert fake.requests["/api/show"] == shown + len(DEFAULT_MODELS)
+    assert sorted(info.name for info in catalog.models.values()) == sorted(DEFAULT_MODELS)
@@ -0,0 +1,60 @@
+import math
+import time
+import background_loop
+import model_residency
+from conversation_engine import ConversationEngine
+
+def test_keep_alive_durations():
+    assert model_residency._duration_seconds("30m") == 1800
+    assert model_residency._duration_seconds("1h30m") == 5400
+    assert model_residency._duration_seconds("90") == 90
+    assert model_residency._duration_seconds("-1") == math.inf
+
+def conversation(turns: int, session_id: str) -> ConversationEngine:
+    model_residency._last_request.clear()
+    return ConversationEngine({ "left": "phi3:3.8b", "right": "llama3.2:3b" }, { "left": "Phi", "right": "Llama" },
+                              { "left": "a", "right": "b" }, "left", "Coffee?", turns, session_id=session_id).start()
+
+def test_resident_models_are_not_loaded_again(fake):
+    loads = fake.requests.get("/api/generate", 0)
+    engine = conversation(8, "residency")
+    for _ in engine.iter_events():
+        pass
+    assert not engine.error
+    # only the second speaker is preloaded, during the first turn; every later turn finds both models resident
+    assert fake.requests.get("/api/generate", 0) - loads == 1
+
+def test_the_next_speaker_loads_while_the_first_one_streams(fake):
+    fake.settings.tokens_per_second = 50 # the first reply streams for 0.4 seconds
+    seen = len(fake.arrivals)
+    engine = conversation(2, "residency-overlap")
+    for _ in engine.iter_events():
+        pass
+    assert not engine.error
+    arrivals = fake.arrivals[seen:]
+    first_chat = next(at for path, at in arrivals if path == "/api/chat")
+    load = next(at for path, at in arrivals if path == "/api/generate")
+    stream_seconds = fake.settings.ttft + fake.settings.response_tokens / fake.settings.tokens_per_second
+    assert load - first_chat < stream_seconds / 2
+
+def test_cancelling_the_conversation_cancels_the_load(fake):
+    fake.settings.tokens_per_second = 20
+    fake.settings.load_seconds = 5
+    engine = conversation(2, "residency-cancel")
+    deadline = time.monotonic() + 5
+    while engine._preload is None and time.monotonic() < deadline:
+        time.sleep(0.01)
+    engine.cancel("stopped")
+    assert engine._preload.cancelled()
+    load = model_residency._loading["llama3.2:3b"]
+    deadline = time.monotonic() + 1
+    while not load.done() and time.monotonic() < deadline: # closing the request takes a moment
+        time.sleep(0.01)
+    assert load.cancelled()
+    assert not model_residency.is_resident("llama3.2:3b")
+
+def test_warming_a_resident_model_sends_nothing(fake):
+    model_residency.touch("phi3:3.8b", "residency-warm")
+    loads = fake.requests.get("/api/generate", 0)
+    background_loop.run(model_residency.warm_async("phi3:3.8b", "residency-warm"))
+    assert fake.requests.get("/api/generate", 0) == loads
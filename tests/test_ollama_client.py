@@ -0,0 +1,44 @@
+import time
+import socket
+import httpx
+import pytest
+import ollama_client
+import ollama_server
+
+def failing(error, failures):
+    calls = []
+    def func():
+        calls.append(1)
+        if len(calls) <= failures:
+            raise error
+        return "ok"
+    return func, calls
+
+def test_connect_errors_are_retried(monkeypatch):
+    monkeypatch.setattr(ollama_client, "RETRY_BACKOFF", 0.001)
+    func, calls = failing(httpx.ConnectError("refused"), failures=2)
+    assert ollama_client.with_retries(func) == "ok"
+    assert len(calls) == 3
+
+def test_broken_responses_are_not_retried(monkeypatch):
+    # the server may already have generated the reply, a retry would generate it twice
+    monkeypatch.setattr(ollama_client, "RETRY_BACKOFF", 0.001)
+    func, calls = failing(httpx.RemoteProtocolError("peer closed connection"), failures=1)
+    with pytest.raises(httpx.RemoteProtocolError):
+        ollama_client.with_retries(func)
+    assert len(calls) == 1
+
+def test_health_checks_give_up_on_a_hung_server(monkeypatch):
+    hung = socket.socket()
+    hung.bind(("127.0.0.1", 0))
+    hung.listen() # accepts connections, never answers
+    host, port = hung.getsockname()
+    monkeypatch.setattr(ollama_client, "OLLAMA_HOST", f"http://{host}:{port}")
+    monkeypatch.setattr(ollama_client, "_clients", {})
+    monkeypatch.setattr(ollama_server, "HEALTH_TIMEOUT", 0.2)
+    started = time.monotonic()
+    try:
+        assert not ollama_server.is_responding()
+    finally:
+        hung.close()
+    assert time.monotonic() - started < 2
@@ -0,0 +1,81 @@
+import re
+import random
+import pytest
+from reasoning_filter import ReasoningFilter, filter_stream
+
+# What the filter must produce, on the complete reply: reasoning blocks and the whitespace after them removed,
+# an unterminated block runs to the end of the reply.
+REASONING = re.compile(r"<think>.*?(?:</think>|$)", re.S)
+HIDDEN = re.compile(r"<think>.*?(?:</think>\s*|$)", re.S)
+
+REPLIES = [
+    "Coffee wins.",
+    "<think>They like tea, disagree.</think>\n\nCoffee wins.",
+    "<think>a</think>Coffee <think>b</think> wins.",
+    "1 < 2 and <thin> is not a tag, neither is </think> out here.",
+    "<think>is 1 < 2? <think> again</think>Yes.",
+    "Coffee.<think>never finished",
+    "<<think>>x</think>>",
+    "<think></think>   ",
+    "Tea <thi",
+]
+
+def run(filter: ReasoningFilter, chunks: list[str]) -> str:
+    return "".join(filter.feed(chunk) for chunk in chunks) + filter.flush()
+
+def reasoning_chunks(chunks: list[str]) -> int:
+    """Chunks with at least one character inside a reasoning block."""
+    reply = "".join(chunks)
+    spans = [match.span() for match in REASONING.finditer(reply) if match.end() > match.start()]
+    count, start = 0, 0
+    for chunk in chunks:
+        end = start + len(chunk)
+        count += any(span_start < end and start < span_end for span_start, span_end in spans)
+        start = end
+    return count
+
+def splits(reply: str):
+    yield [reply]
+    yield list(reply)
+    for index in range(1, len(reply)):
+        yield [reply[:index], reply[index:]]
+    rng = random.Random(reply)
+    for _ in range(20):
+        cuts = sorted(rng.sample(range(1, len(reply)), min(len(reply) - 1, rng.randint(1, 6))))
+        yield [reply[start:end] for start, end in zip([0] + cuts, cuts + [len(reply)])]
+
+@pytest.mark.parametrize("reply", REPLIES)
+def test_matches_the_regex_however_the_reply_is_split(reply):
+    for chunks in splits(reply):
+        reasoning = ReasoningFilter()
+        assert run(reasoning, chunks) == HIDDEN.sub("", reply), chunks
+        assert reasoning.dropped_chars == sum(len(match) for match in REASONING.findall(reply)), chunks
+        assert reasoning.dropped_tokens == reasoning_chunks(chunks), chunks
+
+def test_split_tags_are_held_back_until_known():
+    reasoning = ReasoningFilter()
+    assert reasoning.feed("Hmm <th") == "Hmm "
+    assert reasoning.feed("ink>secret</thi") == ""
+    assert reasoning.feed("nk> Tea.") == "Tea."
+    assert reasoning.dropped_tokens == 3
+
+def test_a_literal_less_than_is_released():
+    reasoning = ReasoningFilter()
+    assert reasoning.feed("1 <") == "1 "
+    assert reasoning.feed(" 2") == "< 2"
+    assert reasoning.feed(" <thin") == " "
+    assert reasoning.flush() == "<thin"
+    assert reasoning.dropped_tokens == 0 and reasoning.dropped_chars == 0
+
+def test_an_unterminated_block_is_dropped():
+    reasoning = ReasoningFilter()
+    assert run(reasoning, ["Tea.", "<think>", "still thinking", "</thi"]) == "Tea."
+    assert reasoning.in_reasoning
+    assert reasoning.dropped_tokens == 3
+
+def test_stream_chunks_are_rewritten():
+    chunks = [{"message": {"content": text}, "done": False} for text in ["<think>", "hm", "</think>", " Tea"]]
+    chunks.append({"message": {"content": ""}, "done": True})
+    reasoning = ReasoningFilter()
+    assert [chunk["message"]["content"] for chunk in filter_stream(chunks, reasoning)] == ["", "", "", "Tea", ""]
+    assert reasoning.dropped_tokens == 3
@@ -0,0 +1,84 @@
+import os
+import threading
+import pytest
+import background_loop
+import ollama_tools
+import reasoning_filter
+import response_cache
+from response_cache import ResponseCache, make_key
+
+MESSAGES = [{"role": "system", "content": "You like coffee."}, {"role": "user", "content": "Coffee?"}]
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    cache = ResponseCache(directory=str(tmp_path))
+    monkeypatch.setattr(response_cache, "_cache", cache)
+    return cache
+
+def test_key_covers_model_messages_and_options():
+    key = make_key("phi3:3.8b", MESSAGES, response_cache.CACHE_OPTIONS)
+    assert key == make_key("phi3:3.8b", [dict(message) for message in MESSAGES], dict(reversed(response_cache.CACHE_OPTIONS.items())))
+    assert key != make_key("llama3.2:3b", MESSAGES, response_cache.CACHE_OPTIONS)
+    assert key != make_key("phi3:3.8b", MESSAGES[:1], response_cache.CACHE_OPTIONS)
+    assert key != make_key("phi3:3.8b", MESSAGES, dict(response_cache.CACHE_OPTIONS, seed=1))
+
+def test_memory_tier_evicts_least_recently_used(tmp_path):
+    cache = ResponseCache(directory=str(tmp_path), memory_limit=10)
+    cache.put("a", ["aaaa"])
+    cache.put("b", ["bbbb"])
+    assert cache.get("a") == ["aaaa"] # a is now the most recent
+    cache.put("c", ["cccc"])
+    assert list(cache.memory) == ["a", "c"]
+    assert cache.memory_bytes == 8
+    assert cache.get("b") == ["bbbb"] # still on disk
+    assert cache.stats()["disk_hits"] == 1
+
+def test_disk_tier_evicts_least_recently_used(tmp_path):
+    cache = ResponseCache(directory=str(tmp_path), disk_limit=45)
+    for age, key in enumerate(["old", "used", "new"]):
+        cache.put(key, ["x" * 10])
+        os.utime(cache._path(key), (1000 + age, 1000 + age))
+    cache.memory.clear()
+    assert cache.get("old") == ["x" * 10] # reading refreshes its age
+    cache.put("newest", ["y" * 10])
+    assert sorted(name[:-5] for name in os.listdir(tmp_path)) == ["new", "newest", "old"] and cache.disk_bytes <= 45
+    assert cache.get("used") is None
+    assert cache.stats()["misses"] == 1
+
+def test_cache_survives_a_restart(tmp_path):
+    ResponseCache(directory=str(tmp_path)).put("key", ["Coffee", " wins."])
+    cache = ResponseCache(directory=str(tmp_path))
+    assert cache.disk_bytes > 0
+    assert cache.get("key") == ["Coffee", " wins."]
+
+def test_async_lookups_read_the_disk_off_the_loop(cache, monkeypatch):
+    cache.put("key", ["Coffee"])
+    cache.memory.clear()
+    threads = []
+    get_disk = cache._get_disk
+    def recording_get_disk(key):
+        threads.append(threading.current_thread())
+        return get_disk(key)
+    monkeypatch.setattr(cache, "_get_disk", recording_get_disk)
+    assert background_loop.run(cache.aget("key")) == ["Coffee"]
+    assert background_loop.run(cache.aget("key")) == ["Coffee"] # from memory now
+    assert len(threads) == 1 and threads[0] is not background_loop._loop_thread
+
+def collect(stream) -> str:
+    async def read():
+        return "".join([chunk["message"]["content"] async for chunk in stream])
+    return background_loop.run(read())
+
+def test_hits_are_replayed_without_a_request(fake, cache, monkeypatch):
+    monkeypatch.setattr(response_cache, "CACHE_ENABLED", True)
+    monkeypatch.setattr(reasoning_filter, "STRIP_REASONING", False)
+    ask = lambda: ollama_tools.get_llm_response_streaming_async("phi3:3.8b", "You like coffee.", "Coffee?", [], session_id="cache-test")
+    requests = fake.requests.get("/api/chat", 0)
+    reply = collect(ask())
+    assert fake.requests["/api/chat"] == requests + 1
+    assert cache.stats()["stores"] == 1
+    assert collect(ask()) == reply
+    sync_reply = ollama_tools.get_llm_response_streaming("phi3:3.8b", "You like coffee.", "Coffee?", [], session_id="cache-test")
+    assert "".join(chunk["message"]["content"] for chunk in sync_reply) == reply
+    assert fake.requests["/api/chat"] == requests + 1
+    assert cache.stats()["memory_hits"] == 2
@@ -0,0 +1,130 @@
+import asyncio
+import pytest
+import scheduler
+from scheduler import Scheduler, SchedulerBusy
+
+async def request(queue: Scheduler, session_id: str, model: str, granted: list) -> None:
+    ticket = await queue.acquire(session_id, model)
+    granted.append(session_id)
+    await asyncio.sleep(0)
+    queue.release(ticket)
+
+async def play(queue: Scheduler, requests: list[tuple[str, str]], held_model="held") -> list[str]:
+    """Queue the requests in order behind a request that holds the only slot, then let them run."""
+    holder = await queue.acquire("holder", held_model)
+    granted = []
+    tasks = [asyncio.create_task(request(queue, session_id, model, granted)) for session_id, model in requests]
+    await asyncio.sleep(0)
+    queue.release(holder)
+    await asyncio.gather(*tasks)
+    return granted
+
+def test_sessions_take_turns():
+    queue = Scheduler(max_concurrency=1, group_by_model=False)
+    requests = [("a", "phi3"), ("a", "phi3"), ("a", "phi3"), ("b", "phi3"), ("c", "llama")]
+    assert asyncio.run(play(queue, requests)) == ["a", "b", "c", "a", "a"]
+
+def test_requests_for_the_last_model_are_grouped_up_to_the_streak_limit():
+    queue = Scheduler(max_concurrency=1, group_by_model=True)
+    same_model = [f"same-{index}" for index in range(scheduler.MAX_MODEL_STREAK + 1)]
+    requests = [("other", "llama")] + [(session_id, "phi3") for session_id in same_model]
+    granted = asyncio.run(play(queue, requests, held_model="phi3"))
+    # the held request started the streak
+    streak = same_model[:scheduler.MAX_MODEL_STREAK - 1]
+    assert granted == streak + ["other"] + same_model[len(streak):]
+
+def test_at_most_max_concurrency_requests_run():
+    async def run():
+        queue = Scheduler(max_concurrency=2)
+        running = []
+        async def generate(session_id):
+            async with queue.slot(session_id, "phi3"):
+                running.append(queue.running)
+                await asyncio.sleep(0.01)
+        await asyncio.gather(*(generate(f"session-{index}") for index in range(5)))
+        return queue, running
+    queue, running = asyncio.run(run())
+    assert max(running) == 2
+    assert queue.running == 0 and not queue.queues
+
+def test_cancelled_while_queued_leaves_the_queue():
+    async def run():
+        queue = Scheduler(max_concurrency=1)
+        holder = await queue.acquire("holder", "phi3")
+        waiting = asyncio.create_task(queue.acquire("a", "phi3"))
+        await asyncio.sleep(0)
+        assert queue.queued == 1
+        waiting.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiting
+        assert queue.queued == 0
+        queue.release(holder)
+        granted = []
+        await request(queue, "b", "phi3", granted)
+        return queue, granted
+    queue, granted = asyncio.run(run())
+    assert granted == ["b"]
+    assert queue.running == 0
+
+def test_cancelled_after_the_grant_releases_the_slot():
+    async def run():
+        queue = Scheduler(max_concurrency=1)
+        holder = await queue.acquire("holder", "phi3")
+        waiting = asyncio.create_task(queue.acquire("a", "phi3"))
+        await asyncio.sleep(0)
+        queue.release(holder) # grants the slot, the waiting task hasn't resumed yet
+        waiting.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiting
+        return queue
+    assert asyncio.run(run()).running == 0
+
+def test_cancelled_while_generating_releases_the_slot():
+    async def run():
+        queue = Scheduler(max_concurrency=1)
+        async def generate():
+            async with queue.slot("a", "phi3"):
+                await asyncio.sleep(10)
+        task = asyncio.create_task(generate())
+        await asyncio.sleep(0.01)
+        assert queue.running == 1
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        return queue
+    assert asyncio.run(run()).running == 0
+
+def test_waiting_requests_learn_their_position():
+    async def run():
+        queue = Scheduler(max_concurrency=1)
+        holder = await queue.acquire("holder", "phi3")
+        positions = { "a": [], "b": [] }
+        tasks = [asyncio.create_task(queue.acquire(session_id, "phi3", positions[session_id].append)) for session_id in positions]
+        await asyncio.sleep(0)
+        queue.release(holder)
+        first = await tasks[0]
+        queue.release(first)
+        queue.release(await tasks[1])
+        return positions
+    assert asyncio.run(run()) == { "a": [1], "b": [2, 1] }
+
+def test_full_queues_raise_busy(monkeypatch):
+    monkeypatch.setattr(scheduler, "MAX_QUEUED", scheduler.MAX_QUEUED_PER_SESSION + 1)
+    async def run():
+        queue = Scheduler(max_concurrency=1)
+        holder = await queue.acquire("holder", "phi3")
+        waiting = [asyncio.create_task(queue.acquire("a", "phi3")) for _ in range(scheduler.MAX_QUEUED_PER_SESSION)]
+        await asyncio.sleep(0)
+        with pytest.raises(SchedulerBusy):
+            await queue.acquire("a", "phi3") # per session
+        waiting.append(asyncio.create_task(queue.acquire("b", "phi3")))
+        await asyncio.sleep(0)
+        with pytest.raises(SchedulerBusy):
+            await queue.acquire("c", "phi3") # in total
+        for task in waiting:
+            task.cancel()
+        await asyncio.gather(*waiting, return_exceptions=True)
+        queue.release(holder)
+        return queue
+    queue = asyncio.run(run())
+    assert queue.queued == 0 and queue.running == 0
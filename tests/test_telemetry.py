@@ -0,0 +1,64 @@
+import os
+import json
+import time
+import threading
+import telemetry
+from telemetry import Aggregate, TurnTimer
+
+def served_chunk(eval_count=40, eval_duration=2e9, prompt_eval_duration=0.5e9, total_duration=3e9) -> dict:
+    return { "message": {"content": ""}, "done": True, "total_duration": total_duration, "load_duration": 0.25e9,
+             "prompt_eval_count": 100, "prompt_eval_duration": prompt_eval_duration, "eval_count": eval_count, "eval_duration": eval_duration }
+
+def timed_turn(session_id: str, final_chunk: dict, gap=0.01):
+    timer = TurnTimer(session_id, "phi3:3.8b")
+    for _ in range(3):
+        time.sleep(gap)
+        timer.chunk({ "message": {"content": "word "}, "done": False })
+    timer.chunk(final_chunk)
+    return timer.finish(reasoning_tokens=2)
+
+def test_turn_timer_measures_the_stream():
+    turn = timed_turn("telemetry-timer", served_chunk(), gap=0.02)
+    assert turn.chunks == 4
+    assert 0.02 <= turn.ttft < turn.duration
+    assert 0.02 <= turn.max_gap < turn.duration
+    assert turn.server["eval_count"] == 40
+    assert not turn.cached
+    assert turn.reasoning_tokens == 2
+
+def test_replayed_turns_count_as_cached():
+    turn = timed_turn("telemetry-cached", { "message": {"content": ""}, "done": True }, gap=0)
+    assert turn.cached
+    assert turn.server == dict.fromkeys(telemetry.SERVER_FIELDS, 0)
+
+def test_summary_rates_and_shares():
+    aggregate = Aggregate()
+    aggregate.add_turn(timed_turn("telemetry-summary", served_chunk(eval_count=40, eval_duration=2e9), gap=0))
+    aggregate.add_turn(timed_turn("telemetry-summary", served_chunk(eval_count=20, eval_duration=1e9, prompt_eval_duration=1.5e9), gap=0))
+    aggregate.add_turn(timed_turn("telemetry-summary", { "message": {"content": ""}, "done": True }, gap=0))
+    summary = aggregate.summary()
+    assert summary["turns"] == 3 and summary["cached_turns"] == 1
+    assert summary["tokens_per_second"] == 20.0 # 60 tokens in 3 seconds of evaluation
+    assert summary["prompt_eval_share"] == round(2 / 6, 3)
+    assert summary["load_time"] == 0.5
+    assert summary["generated_tokens"] == 60 and summary["reasoning_tokens"] == 6
+
+def test_empty_summary_has_no_rates():
+    summary = Aggregate().summary()
+    assert summary["tokens_per_second"] is None and summary["prompt_eval_share"] is None and summary["avg_ttft"] is None
+
+def test_metrics_file_is_written_off_the_calling_thread(tmp_path, monkeypatch):
+    path = str(tmp_path / "metrics.json")
+    monkeypatch.setattr(telemetry, "METRICS_FILE", path)
+    monkeypatch.setattr(telemetry, "_last_write", 0.0)
+    writers = []
+    write = telemetry.write_metrics_file
+    monkeypatch.setattr(telemetry, "write_metrics_file", lambda force=False: (writers.append(threading.current_thread()), write(force)))
+    telemetry.record_cancellation("telemetry-write", 1.5)
+    telemetry.record_cancellation("telemetry-write", 1.5) # within METRICS_INTERVAL, not written again
+    deadline = time.monotonic() + 5
+    while not os.path.exists(path) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    with open(path) as f:
+        assert json.load(f)["counters"]["cancelled_conversations"] >= 1
+    assert len(writers) == 1 and writers[0] is not threading.current_thread()
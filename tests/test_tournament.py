@@ -0,0 +1,56 @@
+import json
+import tournament
+
+MATRIX = {
+    "pairs": [["phi3:3.8b", "llama3.2:3b"], ["qwen2.5:1.5b", "phi3:3.8b"]],
+    "prompts": ["Coffee or tea?"],
+    "turns": [2],
+}
+
+def write_matrix(tmp_path) -> str:
+    path = tmp_path / "matrix.json"
+    path.write_text(json.dumps(MATRIX))
+    return str(path)
+
+def read_records(path) -> list[dict]:
+    with open(path) as f:
+        return [json.loads(line) for line in f]
+
+def test_job_ids_are_stable_and_distinct():
+    jobs = tournament.expand_matrix(MATRIX)
+    assert [job["job_id"] for job in jobs] == [job["job_id"] for job in tournament.expand_matrix(json.loads(json.dumps(MATRIX)))]
+    repeated = tournament.expand_matrix(dict(MATRIX, repeat=2, turns=[2, 4]))
+    assert len(repeated) == 2 * 2 * 2
+    assert len({job["job_id"] for job in repeated}) == len(repeated)
+
+def test_finished_jobs_skip_failures_and_cut_lines(tmp_path):
+    output = tmp_path / "results.jsonl"
+    output.write_text(json.dumps({"job_id": "done", "error": ""}) + "\n"
+                      + json.dumps({"job_id": "failed", "error": "injected failure"}) + "\n"
+                      + '{"job_id": "cut')
+    assert tournament.finished_job_ids(str(output)) == {"done"}
+    assert tournament.finished_job_ids(str(tmp_path / "missing.jsonl")) == set()
+
+def test_a_second_run_plays_nothing(fake, tmp_path, capsys):
+    matrix, output = write_matrix(tmp_path), str(tmp_path / "results.jsonl")
+    assert tournament.main([matrix, "--output", output]) == 0
+    records = read_records(output)
+    assert len(records) == 2 and not any(record["error"] for record in records)
+    assert all(len(record["turns"]) == 2 for record in records)
+    chats = fake.requests["/api/chat"]
+    assert tournament.main([matrix, "--output", output]) == 0
+    assert "0 to play" in capsys.readouterr().out
+    assert read_records(output) == records
+    assert fake.requests["/api/chat"] == chats
+
+def test_failed_conversations_are_played_again(fake, tmp_path):
+    matrix, output = write_matrix(tmp_path), str(tmp_path / "results.jsonl")
+    fake.settings.error_rate = 1.0
+    assert tournament.main([matrix, "--output", output]) == 1
+    assert all(record["error"] for record in read_records(output))
+    fake.settings.error_rate = 0.0
+    assert tournament.main([matrix, "--output", output]) == 0
+    records = read_records(output)
+    assert len(records) == 4 and sum(not record["error"] for record in records) == 2
+    assert tournament.main([matrix, "--output", output]) == 0
+    assert len(read_records(output)) == 4
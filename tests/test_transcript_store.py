@@ -0,0 +1,114 @@
+import os
+import time
+import threading
+from datetime import datetime
+import pytest
+from transcript_store import TranscriptStore
+
+DAY = 24 * 60 * 60
+TODAY = time.time()
+
+def record(conversation_id: str, session_id="s1", models=("phi3:3.8b", "llama3.2:3b"), finished=TODAY) -> dict:
+    return {
+        "conversation_id": conversation_id,
+        "session_id": session_id,
+        "models": { "left": models[0], "right": models[1] },
+        "finished": finished,
+        "turns": [{ "side": "left", "model": models[0], "content": f"Reply of {conversation_id}" }],
+    }
+
+@pytest.fixture(params=["jsonl", "sqlite"])
+def make_store(request, tmp_path):
+    stores = []
+    def make(**settings) -> TranscriptStore:
+        store = TranscriptStore(request.param, directory=str(tmp_path), **settings)
+        stores.append(store)
+        return store
+    yield make
+    for store in stores:
+        store.close()
+
+def data_files(store: TranscriptStore) -> list[str]:
+    return [name for name in os.listdir(store.directory) if name.endswith(store.backend.extension)]
+
+def ids(records: list[dict]) -> list[str]:
+    return sorted(record["conversation_id"] for record in records)
+
+def test_records_are_written_in_batches(make_store):
+    store = make_store(batch_size=3, flush_interval=0.2)
+    batches = []
+    write = store.backend.write
+    store.backend.write = lambda records: (batches.append(len(records)), write(records))
+    for index in range(5):
+        store.save(record(f"c{index}"))
+    store.close()
+    assert batches == [3, 2]
+    assert ids(store.find()) == ["c0", "c1", "c2", "c3", "c4"]
+
+def test_files_roll_over_by_size(make_store):
+    store = make_store(batch_size=1, flush_interval=0.01, max_file_bytes=1)
+    for index in range(3):
+        store.save(record(f"c{index}"))
+    store.close()
+    assert len(data_files(store)) == 3
+    assert ids(store.find()) == ["c0", "c1", "c2"]
+
+def test_files_roll_over_by_age(make_store):
+    store = make_store(batch_size=1, flush_interval=0.01)
+    store.save(record("c0"))
+    store.save(record("c1"))
+    time.sleep(0.2)
+    store.max_file_age = 0
+    store.save(record("c2"))
+    store.close()
+    assert len(data_files(store)) == 2
+    assert ids(store.find()) == ["c0", "c1", "c2"]
+
+def test_find_by_session_model_and_date(make_store):
+    store = make_store(batch_size=10, flush_interval=0.01)
+    store.save(record("c0", session_id="s1", models=("phi3:3.8b", "llama3.2:3b")))
+    store.save(record("c1", session_id="s2", models=("qwen2.5:1.5b", "phi3:3.8b")))
+    store.save(record("c2", session_id="s2", models=("qwen2.5:1.5b", "qwen2.5:1.5b"), finished=TODAY - DAY))
+    store.close()
+    yesterday = datetime.fromtimestamp(TODAY - DAY).strftime("%Y-%m-%d")
+    assert ids(store.find(session_id="s2")) == ["c1", "c2"]
+    assert ids(store.find(model="phi3:3.8b")) == ["c0", "c1"]
+    assert ids(store.find(model="qwen2.5:1.5b")) == ["c1", "c2"]
+    assert ids(store.find(date=yesterday)) == ["c2"]
+    assert ids(store.find(session_id="s2", model="phi3:3.8b")) == ["c1"]
+    assert store.find(session_id="nobody") == []
+    assert store.find(session_id="s1")[0] == record("c0")
+
+def wait_for(store: TranscriptStore, count: int) -> None:
+    deadline = time.monotonic() + 5
+    while len(store.find()) < count and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+def test_find_sees_batches_written_after_earlier_lookups(make_store):
+    store = make_store(batch_size=1, flush_interval=0.01)
+    store.save(record("c0"))
+    wait_for(store, 1)
+    store.save(record("c1"))
+    store.close()
+    assert ids(store.find()) == ["c0", "c1"]
+
+def test_find_does_not_wait_for_the_writer(make_store):
+    store = make_store(batch_size=1, flush_interval=0.01)
+    store.save(record("c0"))
+    wait_for(store, 1)
+    writing = threading.Event()
+    release = threading.Event()
+    write = store.backend.write
+    def slow_write(records):
+        writing.set()
+        release.wait(5)
+        write(records)
+    store.backend.write = slow_write
+    store.save(record("c1"))
+    assert writing.wait(5)
+    try:
+        assert ids(store.find()) == ["c0"]
+    finally:
+        release.set()
+    store.close()
+    assert ids(store.find()) == ["c0", "c1"]
@@ -0,0 +1,68 @@
+import itertools
+import pytest
+import ollama_tools
+import response_cache
+from conversation_engine import ConversationEngine, other_side
+from turn_log import TurnLog
+
+def converse(history: TurnLog, first_side: str, prompt: str, turns=3) -> ConversationEngine:
+    engine = ConversationEngine(
+        models={ "left": "phi3:3.8b", "right": "llama3.2:3b" },
+        aliases={ "left": "Phi", "right": "Llama" },
+        system_prompts={ "left": ollama_tools.DEFAULT_SYSTEM_PROMPT_LEFT, "right": ollama_tools.DEFAULT_SYSTEM_PROMPT_RIGHT },
+        first_side=first_side,
+        initial_prompt=prompt,
+        max_turns=turns,
+        history=history,
+        session_id="turn-log-test",
+    ).start()
+    for _ in engine.iter_events():
+        pass
+    assert not engine.error
+    return engine
+
+def dict_logs(conversations: list[tuple[str, str, list[str]]]) -> dict[str, list[dict]]:
+    """Per-side histories the way they were built before the turn log: every turn appends the prompt it answered
+    and its reply to the speaker's own list of message dicts."""
+    logs = { "left_model_log": [], "right_model_log": [] }
+    for first_side, prompt, replies in conversations:
+        side = first_side
+        for message in replies:
+            logs[f"{side}_model_log"].append({"role": "user", "content": prompt})
+            logs[f"{side}_model_log"].append({"role": "assistant", "content": message})
+            prompt = message
+            side = other_side(side)
+    return logs
+
+@pytest.fixture
+def numbered_replies(fake, monkeypatch):
+    """Every reply says who gave it and what it answered, so a message in the wrong place shows."""
+    numbers = itertools.count()
+    def reply(model, system_prompt, prompt, chat_history, **kwargs):
+        return response_cache.areplay(model, [f"{model} reply {next(numbers)} to {prompt[:20]!r}"])
+    monkeypatch.setattr(ollama_tools, "get_llm_response_streaming_async", reply)
+
+def test_side_views_match_the_per_side_logs(numbered_replies):
+    history = TurnLog()
+    first = converse(history, "left", "Coffee or tea?")
+    second = converse(history, "right", "Cats or dogs?", turns=4)
+    expected = dict_logs([
+        ("left", "Coffee or tea?", [turn.content for turn in first.turns]),
+        ("right", "Cats or dogs?", [turn.content for turn in second.turns]),
+    ])
+    for side in ("left", "right"):
+        view = history.view(side)
+        assert list(view) == expected[f"{side}_model_log"]
+        assert len(view) == len(expected[f"{side}_model_log"])
+        assert view[-1] == expected[f"{side}_model_log"][-1]
+        assert view[1:3] == expected[f"{side}_model_log"][1:3]
+    assert len(history) == 2 + 3 + 4 # one opening prompt per conversation and every reply, each stored once
+
+def test_views_follow_the_log():
+    history = TurnLog()
+    view = history.view("left")
+    history.append("user", "Coffee or tea?")
+    history.append("left", "Coffee.")
+    assert list(view) == [{"role": "user", "content": "Coffee or tea?"}, {"role": "assistant", "content": "Coffee."}]
+    history.clear()
+    assert len(view) == 0 and list(history.view("right")) == []
@@ -0,0 +1,183 @@
+"""Headless batch runner: plays every combination of model pairs, personas, opening prompts and turn counts
+without the UI, many conversations at once, and appends one json line per finished conversation.
+
+    python tournament.py matrix.json --output results.jsonl --parallel 2
+
+matrix.json:
+    {
+        "pairs": [["phi3:3.8b", "llama3.2:3b"], ["qwen2.5:3b", "phi3:3.8b"]],
+        "system_prompts": [{"left": "You love coffee.", "right": "You love tea."}],
+        "prompts": ["Which drink is better?"],
+        "turns": [4, 8],
+        "first_side": ["left"],
+        "repeat": 1
+    }
+
+Only "pairs" and "prompts" are required. Runs are resumable: conversations already in the output file are skipped,
+so an interrupted run continues where it stopped when started again with the same arguments. Failed conversations
+are written too, with their error, and played again on the next run.
+"""
+import os
+import sys
+import json
+import time
+import hashlib
+import asyncio
+import argparse
+import itertools
+import background_loop
+import ollama_tools
+import ollama_server
+import scheduler
+import model_catalog
+from conversation_engine import ConversationEngine
+
+DEFAULT_SYSTEM_PROMPTS = { "left": ollama_tools.DEFAULT_SYSTEM_PROMPT_LEFT, "right": ollama_tools.DEFAULT_SYSTEM_PROMPT_RIGHT }
+DEFAULT_TURNS = 4
+QUEUED_PER_SLOT = 2 # conversations in flight per server slot, so a slot never idles while a turn is handed over
+
+def expand_matrix(matrix: dict) -> list[dict]:
+    """Every combination in the matrix as a job, each with a stable id derived from its settings."""
+    jobs = []
+    combinations = itertools.product(
+        matrix["pairs"],
+        matrix.get("system_prompts", [DEFAULT_SYSTEM_PROMPTS]),
+        matrix["prompts"],
+        matrix.get("turns", [DEFAULT_TURNS]),
+        matrix.get("first_side", ["left"]),
+        range(matrix.get("repeat", 1)),
+    )
+    for (left_model, right_model), system_prompts, prompt, turns, first_side, repetition in combinations:
+        job = {
+            "models": { "left": left_model, "right": right_model },
+            "system_prompts": system_prompts,
+            "initial_prompt": prompt,
+            "max_turns": turns,
+            "first_side": first_side,
+            "repetition": repetition,
+        }
+        job["job_id"] = hashlib.sha256(json.dumps(job, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+        jobs.append(job)
+    return jobs
+
+def finished_job_ids(output_path: str) -> set[str]:
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, "r") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue # a line cut short by an interrupted run
+            if "job_id" in record and not record.get("error"):
+                done.add(record["job_id"]) # failed conversations are played again
+    return done
+
+class Tournament:
+    """Runs jobs as ConversationEngines on the background loop, at most `concurrency` at a time."""
+
+    def __init__(self, jobs: list[dict], output_path: str, concurrency: int, use_context=True):
+        self.jobs = jobs
+        self.output_path = output_path
+        self.concurrency = concurrency
+        self.use_context = use_context
+        self.running = {} # { job_id: ConversationEngine }
+        self.completed = 0
+        self.failed = 0
+        self._output_lock = None
+
+    async def run(self) -> None:
+        semaphore = asyncio.Semaphore(self.concurrency)
+        self._output_lock = asyncio.Lock() # one line at a time, written from worker threads
+        output = await asyncio.to_thread(open, self.output_path, "a")
+        try:
+            await asyncio.gather(*(self._play(job, semaphore, output) for job in self.jobs))
+        finally:
+            await asyncio.to_thread(output.close)
+
+    async def _play(self, job: dict, semaphore: asyncio.Semaphore, output) -> None:
+        async with semaphore:
+            aliases = model_catalog.assign_aliases(list(dict.fromkeys(job["models"].values())))
+            names = { name: alias for alias, name in aliases.items() }
+            engine = ConversationEngine(
+                models=job["models"],
+                aliases={ side: names[model] for side, model in job["models"].items() },
+                system_prompts=job["system_prompts"],
+                first_side=job["first_side"],
+                initial_prompt=job["initial_prompt"],
+                max_turns=job["max_turns"],
+                use_context=self.use_context,
+                session_id=f"tournament-{job['job_id']}", # one fair queue per conversation
+            )
+            self.running[job["job_id"]] = engine
+            engine.start()
+            async for _ in engine:
+                pass
+            del self.running[job["job_id"]]
+        if engine.cancel_reason:
+            return # interrupted, played again on resume
+        record = dict(engine.to_record(), job_id=job["job_id"], repetition=job["repetition"])
+        async with self._output_lock:
+            # the loop keeps streaming the other conversations while the file is written
+            await asyncio.to_thread(_append, output, json.dumps(record, ensure_ascii=False) + "\n")
+        if engine.error:
+            self.failed += 1
+        else:
+            self.completed += 1
+        print(f"[{self.completed + self.failed}/{len(self.jobs)}] {job['models']['left']} vs {job['models']['right']}, "
+              f"{job['max_turns']} turns in {engine.finished_at - engine.started:.1f}s" + (f" failed: {engine.error}" if engine.error else ""))
+
+    def cancel(self) -> None:
+        """Stop the conversations in flight, from the main thread."""
+        for engine in list(self.running.values()):
+            engine.cancel("interrupted")
+
+def _append(output, line: str) -> None:
+    output.write(line)
+    output.flush()
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Play many model conversations headlessly and write them to JSONL.")
+    parser.add_argument("matrix", help="json file with pairs, system_prompts, prompts, turns, first_side and repeat")
+    parser.add_argument("--output", default=os.path.join("logs", "tournament.jsonl"), help="JSONL file results are appended to")
+    parser.add_argument("--parallel", type=int, default=scheduler.MAX_CONCURRENCY,
+                        help="generations sent to Ollama at once, set it to the server's OLLAMA_NUM_PARALLEL")
+    parser.add_argument("--concurrency", type=int, default=None,
+                        help=f"conversations in flight (default {QUEUED_PER_SLOT} per parallel slot)")
+    parser.add_argument("--no-context", action="store_true", help="don't send the conversation history with each turn")
+    return parser.parse_args(argv)
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    with open(args.matrix, "r") as f:
+        jobs = expand_matrix(json.load(f))
+    done = finished_job_ids(args.output)
+    pending = [job for job in jobs if job["job_id"] not in done]
+    print(f"{len(jobs)} conversations, {len(jobs) - len(pending)} already in {args.output}, {len(pending)} to play")
+    if not pending:
+        return 0
+    if os.path.dirname(args.output):
+        os.makedirs(os.path.dirname(args.output), exist_ok=True)
+
+    ollama_server.get_server().ensure_started()
+    # the scheduler is created on the loop, resize it there before any request arrives
+    background_loop.run(_set_parallel(args.parallel))
+    tournament = Tournament(pending, args.output, args.concurrency or args.parallel * QUEUED_PER_SLOT, use_context=not args.no_context)
+    started = time.monotonic()
+    run = background_loop.submit(tournament.run())
+    try:
+        run.result()
+    except KeyboardInterrupt:
+        print("Interrupted, stopping the conversations in flight. Run again to resume.")
+        run.cancel()
+        tournament.cancel()
+        return 130
+    print(f"Played {tournament.completed + tournament.failed} conversations in {time.monotonic() - started:.1f}s, {tournament.failed} failed")
+    return 1 if tournament.failed else 0
+
+async def _set_parallel(parallel: int) -> None:
+    scheduler.get_scheduler().max_concurrency = parallel
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,236 @@
+import os
+import json
+import time
+import queue
+import sqlite3
+import threading
+import atexit
+import contextlib
+from datetime import datetime
+
+# Finished conversations are written once, by a background thread, in batches. Files roll over by size and age.
+TRANSCRIPT_DIR = os.environ.get("TALKING_HEADS_TRANSCRIPT_DIR", os.path.join(os.path.dirname(__file__), "logs", "transcripts"))
+BACKEND = os.environ.get("TALKING_HEADS_TRANSCRIPT_BACKEND", "jsonl") # "jsonl" or "sqlite"
+MAX_FILE_BYTES = 50 * 1024 * 1024
+MAX_FILE_AGE = 24 * 60 * 60 # seconds
+BATCH_SIZE = 20
+FLUSH_INTERVAL = 2.0 # seconds a record may wait for its batch to fill up
+
+def _index_fields(record: dict) -> dict:
+    return {
+        "conversation_id": record["conversation_id"],
+        "session_id": record.get("session_id", ""),
+        "models": sorted(set(record.get("models", {}).values())),
+        "date": datetime.fromtimestamp(record.get("finished", time.time())).strftime("%Y-%m-%d"),
+    }
+
+class JsonlBackend:
+    """One conversation per line. Every transcript file has an index file next to it that maps its conversations
+    to their offsets, so lookups read the small indexes instead of the transcripts. Index lines already read are
+    kept, a lookup only parses what was appended since the last one."""
+
+    extension = ".jsonl"
+    index_extension = ".index"
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.path = None
+        self.index_path = None
+        self._file = None
+        self.opened = 0.0
+        self._indexes = {} # { index file name: (bytes read, entries) }
+        self._indexes_lock = threading.Lock()
+
+    def open(self, path: str) -> None:
+        self.close()
+        self.path = path
+        self.index_path = path[:-len(self.extension)] + self.index_extension
+        self._file = open(path, "ab")
+        self.opened = time.time()
+
+    def size(self) -> int:
+        return self._file.tell() if self._file else 0
+
+    def write(self, records: list[dict]) -> None:
+        index_lines = []
+        for record in records:
+            offset = self._file.tell()
+            self._file.write(json.dumps(record, ensure_ascii=False).encode("utf-8") + b"\n")
+            entry = dict(_index_fields(record), offset=offset)
+            index_lines.append(json.dumps(entry) + "\n")
+        # the index is written after the transcripts are flushed, so readers never find an offset that isn't there yet
+        self._file.flush()
+        with open(self.index_path, "a") as index:
+            index.writelines(index_lines)
+
+    def find(self, session_id=None, model=None, date=None) -> list[dict]:
+        records = []
+        for name in sorted(os.listdir(self.directory)):
+            if not name.endswith(self.index_extension):
+                continue
+            entries = [entry for entry in self._index_entries(name) if _matches(entry, session_id, model, date)]
+            if not entries:
+                continue
+            with open(os.path.join(self.directory, name[:-len(self.index_extension)] + self.extension), "rb") as f:
+                for entry in entries:
+                    f.seek(entry["offset"])
+                    records.append(json.loads(f.readline()))
+        return records
+
+    def _index_entries(self, name: str) -> list[dict]:
+        with self._indexes_lock:
+            read, entries = self._indexes.get(name, (0, []))
+            with open(os.path.join(self.directory, name), "rb") as index:
+                index.seek(read)
+                data = index.read()
+            complete = data[:data.rfind(b"\n") + 1] # a line still being written is left for the next lookup
+            entries = entries + [json.loads(line) for line in complete.splitlines() if line.strip()]
+            self._indexes[name] = (read + len(complete), entries)
+            return entries
+
+    def close(self) -> None:
+        if self._file:
+            self._file.close()
+            self._file = None
+
+class SqliteBackend:
+    """Conversations as json in an indexed table, one database file per rotation period."""
+
+    extension = ".sqlite3"
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.path = None
+        self._db = None
+        self.opened = 0.0
+
+    def open(self, path: str) -> None:
+        self.close()
+        self.path = path
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS conversations (
+                conversation_id TEXT PRIMARY KEY,
+                session_id TEXT,
+                date TEXT,
+                record TEXT
+            );
+            CREATE TABLE IF NOT EXISTS conversation_models (
+                conversation_id TEXT,
+                model TEXT
+            );
+            CREATE INDEX IF NOT EXISTS by_session ON conversations (session_id);
+            CREATE INDEX IF NOT EXISTS by_date ON conversations (date);
+            CREATE INDEX IF NOT EXISTS by_model ON conversation_models (model);
+        """)
+        self.opened = time.time()
+
+    def size(self) -> int:
+        return os.path.getsize(self.path) if self.path and os.path.exists(self.path) else 0
+
+    def write(self, records: list[dict]) -> None:
+        with self._db:
+            for record in records:
+                fields = _index_fields(record)
+                self._db.execute("INSERT OR REPLACE INTO conversations VALUES (?, ?, ?, ?)",
+                                 (fields["conversation_id"], fields["session_id"], fields["date"], json.dumps(record, ensure_ascii=False)))
+                self._db.executemany("INSERT INTO conversation_models VALUES (?, ?)", [(fields["conversation_id"], model) for model in fields["models"]])
+
+    def find(self, session_id=None, model=None, date=None) -> list[dict]:
+        query = "SELECT DISTINCT c.record FROM conversations c LEFT JOIN conversation_models m ON c.conversation_id = m.conversation_id WHERE 1 = 1"
+        params = []
+        for column, value in (("c.session_id", session_id), ("m.model", model), ("c.date", date)):
+            if value is not None:
+                query += f" AND {column} = ?"
+                params.append(value)
+        records = []
+        for name in sorted(os.listdir(self.directory)):
+            if name.endswith(self.extension):
+                # a separate read-only connection, the writer thread owns self._db
+                with contextlib.closing(sqlite3.connect(f"file:{os.path.join(self.directory, name)}?mode=ro", uri=True)) as db:
+                    try:
+                        records.extend(json.loads(row[0]) for row in db.execute(query, params))
+                    except sqlite3.OperationalError as e:
+                        # a file the writer has just created may not have its tables yet
+                        if "no such table" not in str(e):
+                            raise
+        return records
+
+    def close(self) -> None:
+        if self._db:
+            self._db.close()
+            self._db = None
+
+def _matches(entry: dict, session_id, model, date) -> bool:
+    return ((session_id is None or entry["session_id"] == session_id)
+            and (model is None or model in entry["models"])
+            and (date is None or entry["date"] == date))
+
+BACKENDS = { "jsonl": JsonlBackend, "sqlite": SqliteBackend }
+
+class TranscriptStore:
+    """Queues finished conversations and writes them from a background thread, so the page never waits on disk."""
+
+    def __init__(self, backend="jsonl", directory=TRANSCRIPT_DIR, batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL,
+                 max_file_bytes=MAX_FILE_BYTES, max_file_age=MAX_FILE_AGE):
+        os.makedirs(directory, exist_ok=True)
+        self.backend = BACKENDS[backend](directory)
+        self.directory = directory
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_file_bytes = max_file_bytes
+        self.max_file_age = max_file_age
+        self._queue = queue.Queue()
+        self._writer = threading.Thread(target=self._write_loop, name="transcript-writer", daemon=True)
+        self._writer.start()
+
+    def save(self, record: dict) -> None:
+        self._queue.put(record)
+
+    def find(self, session_id=None, model=None, date=None) -> list[dict]:
+        """Conversations by session, model (either side) and/or date ("YYYY-MM-DD"). Reads what is on disk
+        without waiting for the writer."""
+        return self.backend.find(session_id, model, date)
+
+    def close(self) -> None:
+        self._queue.put(None)
+        self._writer.join(timeout=10)
+
+    def _rotate_if_needed(self) -> None:
+        backend = self.backend
+        if backend.path is None or backend.size() >= self.max_file_bytes or time.time() - backend.opened >= self.max_file_age:
+            name = f"transcripts-{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}{backend.extension}"
+            backend.open(os.path.join(self.directory, name))
+
+    def _write_loop(self) -> None:
+        stopping = False
+        while not stopping:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size and batch[-1] is not None:
+                try:
+                    batch.append(self._queue.get(timeout=max(0.0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            if batch[-1] is None:
+                stopping = True
+                batch.pop()
+            if not batch:
+                continue
+            try:
+                self._rotate_if_needed()
+                self.backend.write(batch)
+            except Exception as e:
+                print(f"Could not write {len(batch)} transcripts: {e}")
+        self.backend.close()
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_store() -> TranscriptStore:
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = TranscriptStore(BACKEND)
+            atexit.register(_store.close)
+    return _store
@@ -0,0 +1,66 @@
+from collections.abc import Sequence
+
+OPENER = "user" # speaker of the prompt a visitor opens a conversation with
+
+class Turn:
+    """One message of a conversation, stored once however many histories it appears in."""
+
+    __slots__ = ("speaker", "model", "content")
+
+    def __init__(self, speaker: str, content: str, model=""):
+        self.speaker = speaker # "left", "right" or OPENER
+        self.model = model
+        self.content = content
+
+    def __repr__(self):
+        return f"Turn({self.speaker!r}, {self.content[:30]!r})"
+
+class TurnLog:
+    """Append-only log of everything said in a session's conversations. Each side's chat history, with roles
+    swapped to that model's point of view, is a lazy view over it: a reply is stored once, not once as the speaker's
+    "assistant" message and again as the other side's "user" message."""
+
+    def __init__(self):
+        self.turns = []
+        self._replies = {} # { side: indexes of that side's turns }, a prompt is always the turn before its reply
+
+    def append(self, speaker: str, content: str, model="") -> Turn:
+        turn = Turn(speaker, content, model)
+        if speaker != OPENER:
+            self._replies.setdefault(speaker, []).append(len(self.turns))
+        self.turns.append(turn)
+        return turn
+
+    def view(self, side: str) -> "SideView":
+        """Chat history of one side, as Ollama messages."""
+        return SideView(self, side)
+
+    def clear(self) -> None:
+        self.turns.clear()
+        self._replies.clear()
+
+    def __len__(self) -> int:
+        return len(self.turns)
+
+class SideView(Sequence):
+    """[{"role": "user", ...}, {"role": "assistant", ...}, ...] for every turn of `side`: the prompt it answered, then
+    its reply. Message dicts are built when read and not kept."""
+
+    def __init__(self, log: TurnLog, side: str):
+        self.log = log
+        self.side = side
+
+    def __len__(self) -> int:
+        return 2 * len(self.log._replies.get(self.side, ()))
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("side view index out of range")
+        reply = self.log._replies[self.side][index // 2]
+        if index % 2:
+            return {"role": "assistant", "content": self.log.turns[reply].content}
+        return {"role": "user", "content": self.log.turns[reply - 1].content}